@@ -0,0 +1,88 @@
+'''
+Checks AdbClient against the fake adb server of stub_backend and measures
+the latency of shell commands, forwards, pushes, pulls and installs through
+the adb server, compared with starting the (fake) adb executable for each
+shell command.
+
+    python benchmarks/adb_client.py [iterations]
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from stub_backend import FakeAdbServer, fake_sdk, write_apk
+
+from AndroidLibrary import AndroidLibrary
+from AndroidLibrary.adbclient import AdbClient
+
+SERIAL = 'emulator-5554'
+
+
+def check(client, server, directory):
+    assert client.devices() == [(SERIAL, 'device')], 'devices: %r' % client.devices()
+
+    rc, output = client.shell(SERIAL, 'printf abc; false')
+    assert (rc, output) == (1, 'abc'), 'shell: %r' % ((rc, output), )
+
+    client.forward(SERIAL, 'tcp:34777', 'tcp:7102')
+    assert any('forward:tcp:34777;tcp:7102' in request for request in server.requests), 'forward was not requested'
+
+    local = os.path.join(directory, 'data.bin')
+    with open(local, 'wb') as f:
+        f.write(os.urandom(200 * 1024))
+    client.push(SERIAL, local, '/sdcard/data.bin')
+    pulled = os.path.join(directory, 'pulled.bin')
+    client.pull(SERIAL, '/sdcard/data.bin', pulled)
+    with open(local, 'rb') as f, open(pulled, 'rb') as g:
+        assert f.read() == g.read(), 'pulled file differs from the pushed one'
+
+    apk = write_apk(os.path.join(directory, 'app.apk'))
+    rc, output, errput = client.execute(SERIAL, ['install', '-r', apk])
+    assert rc == 0 and 'Success' in output, 'install: %r' % ((rc, output, errput), )
+    assert '/data/local/tmp/app.apk' in server.files, 'the apk was not pushed'
+    return local, apk
+
+
+def measure(operation, iterations):
+    timings = []
+    for i in range(iterations):
+        start = time.time()
+        operation()
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+    return sum(timings) / len(timings), timings[len(timings) // 2]
+
+
+def main(iterations=100):
+    server = FakeAdbServer().start()
+    directory = tempfile.mkdtemp(prefix='androidlibrary-adb-')
+    try:
+        client = AdbClient(*server.address.split(':'))
+        local, apk = check(client, server, directory)
+        print 'AdbClient works with the fake adb server'
+
+        with fake_sdk() as android_home:
+            library = AndroidLibrary(android_home)
+            operations = [
+                ('adb executable shell', lambda: library._execute_with_timeout(
+                    [library._adb, 'shell', 'true'], max_attempts=1)),
+                ('client shell', lambda: client.shell(SERIAL, 'true')),
+                ('client forward', lambda: client.forward(SERIAL, 'tcp:34777', 'tcp:7102')),
+                ('client push 200KB', lambda: client.push(SERIAL, local, '/sdcard/data.bin')),
+                ('client pull 200KB', lambda: client.pull(SERIAL, '/sdcard/data.bin',
+                                                          os.path.join(directory, 'pulled.bin'))),
+                ('client install', lambda: client.execute(SERIAL, ['install', '-r', apk])),
+            ]
+            for name, operation in operations:
+                mean, median = measure(operation, iterations)
+                print '%-22s mean %7.2fms  median %7.2fms' % (name, mean, median)
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,49 @@
+'''
+Compares the per-keyword latency of remote keywords with a pooled keep-alive
+session against opening a new connection for every request.
+
+    python benchmarks/http_session.py [iterations]
+'''
+
+import sys
+import time
+
+from stub_backend import StubBackend, fake_sdk
+
+from AndroidLibrary import AndroidLibrary
+
+
+def measure(library, iterations):
+    timings = []
+    for i in range(iterations):
+        start = time.time()
+        library.touch_text('Views')
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+    return timings
+
+
+def report(name, timings):
+    print '%-12s mean %6.2fms  median %6.2fms  p95 %6.2fms' % (
+        name,
+        sum(timings) / len(timings),
+        timings[len(timings) // 2],
+        timings[int(len(timings) * 0.95)],
+    )
+
+
+def main(iterations=500):
+    backend = StubBackend().start()
+    try:
+        with fake_sdk() as android_home:
+            for name, pool_size in (('no pooling', 0), ('pooled', 4)):
+                library = AndroidLibrary(android_home, http_pool_size=pool_size)
+                library.set_device_url(backend.url)
+                library.connect_to_testserver()
+                report(name, measure(library, iterations))
+    finally:
+        backend.stop()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,75 @@
+'''
+Checks `Start Logcat Capture`, `Log Logcat` and `Stop Logcat Capture`
+against the fake adb of stub_backend and measures how long `Log Logcat`
+takes for the lines collected while capturing.
+
+    python benchmarks/logcat.py [seconds to capture] [iterations]
+'''
+
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from stub_backend import fake_sdk
+
+from AndroidLibrary import AndroidLibrary
+
+
+def check(library, directory):
+    # the defaults, as in a plain | Start Logcat Capture |
+    library.start_logcat_capture()
+    time.sleep(0.2)
+    lines = library.log_logcat('all').splitlines()
+    assert lines and all('Fake' in line for line in lines), 'log: %r' % lines[:3]
+    try:
+        library.log_logcat()
+    except AssertionError:
+        pass
+    else:
+        raise AssertionError('Log Logcat since the test did not fail outside of a test')
+
+    library.ROBOT_LIBRARY_LISTENER.start_test('Test', {})
+    time.sleep(0.2)
+    since_test = library.log_logcat().splitlines()
+    assert since_test and since_test[0] not in lines, 'log of the test: %r' % since_test[:3]
+    library.ROBOT_LIBRARY_LISTENER.end_test('Test', {})
+    assert library.stop_logcat_capture() is None
+
+    library.start_logcat_capture(tags='Fake,Other', priority='I', max_lines=5, filename='logcat.txt.gz')
+    time.sleep(0.2)
+    assert len(library.log_logcat('all').splitlines()) == 5, 'more lines than max_lines were kept'
+    path = library.stop_logcat_capture()
+    assert path == os.path.join(directory, 'logcat.txt.gz'), 'path: %r' % path
+    with gzip.open(path) as f:
+        assert len(f.read().splitlines()) > 5, 'the file does not contain the whole log'
+
+
+def main(seconds=2, iterations=20):
+    directory = tempfile.mkdtemp(prefix='androidlibrary-logcat-')
+    try:
+        with fake_sdk() as android_home:
+            library = AndroidLibrary(android_home)
+            library._get_log_dir = lambda: directory
+            check(library, directory)
+            print 'Logcat capture works with the fake adb'
+
+            library.start_logcat_capture()
+            time.sleep(int(seconds))
+            timings = []
+            for i in range(int(iterations)):
+                start = time.time()
+                lines = library.log_logcat('all').count('\n')
+                timings.append((time.time() - start) * 1000)
+            library.stop_logcat_capture()
+            timings.sort()
+            print 'Log Logcat of %d lines  mean %7.2fms  median %7.2fms' % (
+                lines, sum(timings) / len(timings), timings[len(timings) // 2])
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,52 @@
+'''
+Measures how long reading the package name and main activity from an apk
+takes, decoding the binary manifest and from the memoized result.
+
+    python benchmarks/manifest.py [iterations] [activities]
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from stub_backend import write_apk
+
+from AndroidLibrary import axml
+
+
+def measure(apk, iterations, memoized):
+    timings = []
+    for i in range(iterations):
+        if not memoized:
+            axml._manifests.clear()
+        start = time.time()
+        axml.apk_main_activity(apk)
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+    return timings
+
+
+def report(name, timings):
+    print '%-12s mean %7.3fms  median %7.3fms  p95 %7.3fms' % (
+        name,
+        sum(timings) / len(timings),
+        timings[len(timings) // 2],
+        timings[int(len(timings) * 0.95)],
+    )
+
+
+def main(iterations=200, activities=100):
+    directory = tempfile.mkdtemp(prefix='androidlibrary-manifest-')
+    try:
+        apk = write_apk(os.path.join(directory, 'app.apk'), 'com.example.app',
+                        ['.Activity%d' % i for i in range(activities)], '.Activity%d' % (activities - 1))
+        report('decode', measure(apk, iterations, False))
+        report('memoized', measure(apk, iterations, True))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
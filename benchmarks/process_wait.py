@@ -0,0 +1,58 @@
+'''
+Stress test for waiting on many killableprocess children at once.
+
+Starts 200 short-lived children, each waited for with a timeout from its own
+thread, and checks that all of them are reaped with their exit code. Then
+reports how accurately a wait() with timeout kills a child that hangs.
+
+    python benchmarks/process_wait.py [children]
+'''
+
+import sys
+import threading
+import time
+
+import stub_backend  # puts src/ on sys.path
+
+from AndroidLibrary import killableprocess
+
+
+def wait_for_children(count):
+    results = [None] * count
+
+    def run(index):
+        p = killableprocess.Popen(['sh', '-c', 'sleep 0.0%d; exit %d' % (index % 10, index % 7)])
+        results[index] = (p.wait(30), index % 7)
+
+    start = time.time()
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - start
+
+    wrong = [i for i, result in enumerate(results) if result is None or result[0] != result[1]]
+    assert not wrong, 'Children %r returned a wrong exit code' % wrong
+    print '%d concurrent children reaped in %.0fms' % (count, duration * 1000)
+
+
+def timeout_accuracy(timeout=0.25, rounds=10):
+    overshoots = []
+    for i in range(rounds):
+        p = killableprocess.Popen(['sleep', '10'])
+        start = time.time()
+        rc = p.wait(timeout)
+        overshoots.append((time.time() - start - timeout) * 1000)
+        assert rc == -9, 'Child was not killed: %r' % rc
+    print 'wait(%.2f) killed after the timeout +%.2fms on average, +%.2fms at most' % (
+        timeout, sum(overshoots) / len(overshoots), max(overshoots))
+
+
+def main(children=200):
+    wait_for_children(children)
+    timeout_accuracy()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
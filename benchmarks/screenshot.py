@@ -0,0 +1,86 @@
+'''
+Measures milliseconds and bytes on disk per `Capture Screenshot` for the
+different screenshot options. Converting and scaling are only measured if
+the Python Imaging Library is installed.
+
+    python benchmarks/screenshot.py [iterations]
+'''
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from cStringIO import StringIO
+
+from stub_backend import StubBackend, fake_sdk
+
+from AndroidLibrary import AndroidLibrary
+from AndroidLibrary.screenshots import Image
+
+MODES = [
+    ('png', {}),
+    ('png background', {'background': True}),
+    ('jpeg q70', {'format': 'jpeg', 'quality': 70}),
+    ('jpeg q70 480px', {'format': 'jpeg', 'quality': 70, 'max_width': 480}),
+    ('  background', {'format': 'jpeg', 'quality': 70, 'max_width': 480, 'background': True}),
+    ('webp q70', {'format': 'webp', 'quality': 70}),
+]
+
+
+def screenshot():
+    '''
+    A phone sized PNG with some structure, or random bytes of similar size
+    without PIL
+    '''
+    if Image is None:
+        return os.urandom(1024 * 1024)
+    image = Image.new('RGB', (1080, 1920), (250, 250, 250))
+    for y in range(0, 1920, 160):
+        color = tuple(random.randint(0, 255) for i in range(3))
+        image.paste(color, (40, y + 20, 1040, y + 140))
+    # a photo like area, which compresses badly as PNG
+    image.paste(Image.frombytes('RGB', (1000, 600), os.urandom(1000 * 600 * 3)), (40, 660))
+    output = StringIO()
+    image.save(output, 'PNG')
+    return output.getvalue()
+
+
+def measure(library, directory, iterations):
+    timings = []
+    for i in range(iterations):
+        start = time.time()
+        library.capture_screenshot()
+        timings.append((time.time() - start) * 1000)
+    library.wait_for_screenshots()
+    sizes = [os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)]
+    timings.sort()
+    return timings, sum(sizes) / len(sizes)
+
+
+def main(iterations=50):
+    backend = StubBackend(screenshot()).start()
+    try:
+        with fake_sdk() as android_home:
+            for name, options in MODES:
+                if Image is None and (options.get('format') or options.get('max_width')):
+                    continue
+                directory = tempfile.mkdtemp(prefix='androidlibrary-screenshots-')
+                try:
+                    library = AndroidLibrary(android_home)
+                    library._get_log_dir = lambda: directory
+                    library.set_device_url(backend.url)
+                    library.set_screenshot_options(**options)
+                    timings, size = measure(library, directory, iterations)
+                    print '%-16s mean %7.2fms  median %7.2fms  %8d bytes' % (
+                        name, sum(timings) / len(timings), timings[len(timings) // 2], size)
+                    library.set_screenshot_options()
+                finally:
+                    shutil.rmtree(directory)
+    finally:
+        backend.stop()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,408 @@
+'''
+Local stand-ins for the pieces of an Android setup the library talks to.
+
+`StubBackend` emulates the HTTP interface of the calabash instrumentation
+backend, `FakeAdbServer` the host protocol of the adb server and `fake_sdk`
+creates an ANDROID_HOME with fake `adb`, `emulator` and `calabash-android`
+executables so AndroidLibrary can be used without a real SDK. `write_apk` creates an apk that contains
+nothing but a binary AndroidManifest.xml.
+'''
+
+import json
+import os
+import shutil
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import zipfile
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn, TCPServer, BaseRequestHandler
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from AndroidLibrary.installcache import InstallCache
+from AndroidLibrary.screenrecord import ScreenRecorder
+
+# smallest valid PNG image (1x1 pixel, transparent)
+PNG_1x1 = ('\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01'
+           '\x08\x06\x00\x00\x00\x1f\x15\xc4\x89\x00\x00\x00\rIDATx\x9cc\xf8\x0f'
+           '\x00\x00\x01\x01\x00\x05\x18\xd8N\x00\x00\x00\x00IEND\xaeB`\x82')
+
+
+# view hierarchy of a login screen
+VIEW_DUMP = {
+    'type': 'com.android.internal.policy.impl.PhoneWindow$DecorView', 'id': None, 'visible': True,
+    'children': [
+        {'type': 'android.widget.TextView', 'id': 'com.example.app:id/title', 'value': 'Welcome', 'visible': True},
+        {'type': 'android.widget.EditText', 'id': 'com.example.app:id/username', 'value': 'Username', 'visible': True},
+        {'type': 'android.widget.EditText', 'id': 'com.example.app:id/password', 'value': 'Password', 'visible': True},
+        {'type': 'android.widget.Button', 'id': 'com.example.app:id/login_button', 'value': 'Login',
+         'label': 'Log in', 'visible': True},
+        {'type': 'android.widget.ProgressBar', 'id': 'com.example.app:id/progress', 'visible': False},
+    ],
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    # keep-alive needs HTTP/1.1, BaseHTTPServer defaults to 1.0
+    protocol_version = 'HTTP/1.1'
+    # send each response in one segment, unbuffered writes run into
+    # Nagle's algorithm on kept-alive connections
+    wbufsize = -1
+    # responses larger than the write buffer still take several writes
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, body, content_type='text/plain', status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        backend = self.server.backend
+        backend.requests += 1
+        path = self.path.strip('/')
+        if path == 'ping':
+            self._reply('pong')
+        elif path == 'kill':
+            self._reply('Affirmative!')
+        elif path == 'screenshot':
+            self._reply(backend.screenshot, 'image/png')
+        elif path == 'dump':
+            self._reply(json.dumps(backend.dump), 'application/json')
+        else:
+            self._reply('not found', status=404)
+
+    def do_POST(self):
+        backend = self.server.backend
+        backend.requests += 1
+        length = int(self.headers.getheader('Content-Length') or 0)
+        action = json.loads(self.rfile.read(length))
+        backend.actions.append(action)
+        self._reply(json.dumps(backend.respond(action)), 'application/json')
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubBackend(object):
+    '''
+    Serves `/`, `/ping`, `/kill`, `/screenshot` and `/dump` like the
+    calabash InstrumentationBackend does, on a free port of localhost.
+    '''
+
+    def __init__(self, screenshot=PNG_1x1):
+        self.screenshot = screenshot
+        self.dump = VIEW_DUMP
+        self.requests = 0
+        self.actions = []
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.backend = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://localhost:%d/' % self._server.server_address[1]
+
+    def respond(self, action):
+        return {"success": True, "message": "", "bonusInformation": []}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _AdbHandler(BaseRequestHandler):
+
+    def _read(self, length):
+        data = ''
+        while len(data) < length:
+            chunk = self.request.recv(length - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def _okay(self, payload=None):
+        self.request.sendall('OKAY')
+        if payload is not None:
+            self.request.sendall('%04x%s' % (len(payload), payload))
+
+    def handle(self):
+        server = self.server.adb
+        try:
+            while True:
+                request = self._read(int(self._read(4), 16))
+                server.requests.append(request)
+                if request.startswith('host:transport'):
+                    self._okay()
+                elif request == 'host:devices':
+                    self._okay(''.join('%s\tdevice\n' % serial for serial in server.serials))
+                elif ':forward:' in request:
+                    self._okay()
+                    self._okay()
+                    return
+                elif request.startswith('shell:'):
+                    self._okay()
+                    self.request.sendall(server.shell(request[len('shell:'):]))
+                    return
+                elif request == 'sync:':
+                    self._okay()
+                    self._sync(server)
+                    return
+                else:
+                    self.request.sendall('FAIL%04x%s' % (len('unknown'), 'unknown'))
+                    return
+        except EOFError:
+            pass
+
+    def _sync(self, server):
+        while True:
+            command, length = struct.unpack('<4sI', self._read(8))
+            if command == 'SEND':
+                path = self._read(length).rsplit(',', 1)[0]
+                data = []
+                while True:
+                    command, length = struct.unpack('<4sI', self._read(8))
+                    if command == 'DONE':
+                        break
+                    data.append(self._read(length))
+                server.files[path] = ''.join(data)
+                self.request.sendall('OKAY' + struct.pack('<I', 0))
+            elif command == 'RECV':
+                path = self._read(length)
+                data = server.files.get(path, '')
+                self.request.sendall('DATA' + struct.pack('<I', len(data)) + data)
+                self.request.sendall('DONE' + struct.pack('<I', 0))
+            else:
+                return
+
+
+class _AdbServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+# directories the library writes to on the device
+_DEVICE_DIRS = ((InstallCache, 'FINGERPRINT_DIR'), (ScreenRecorder, 'REMOTE_DIR'))
+
+
+def _move_device_dirs(root):
+    '''
+    Points the directories the library writes to on the device into `root`,
+    as the fake shells run device commands on the local machine. Returns
+    the previous directories for _restore_device_dirs.
+    '''
+    previous = []
+    for cls, name in _DEVICE_DIRS:
+        previous.append(getattr(cls, name))
+        path = os.path.join(root, getattr(cls, name).lstrip('/'))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        setattr(cls, name, path)
+    return previous
+
+
+def _restore_device_dirs(previous):
+    for (cls, name), path in zip(_DEVICE_DIRS, previous):
+        setattr(cls, name, path)
+
+
+class FakeAdbServer(object):
+    '''
+    Speaks the host protocol of the adb server on a free port of localhost.
+    Shell commands are run by the local /bin/sh with stand-ins for the
+    Android tools in `shell_functions`, pushed files are kept in `files`.
+    While it runs, the directories the library writes to on the device are
+    in a temporary directory.
+    '''
+
+    shell_functions = ('pm() { [ "$1" = path ] && echo package:/system/framework/$2.apk || echo Success; }; '
+                       'input() { :; }; getprop() { echo 1; }; rm() { :; }; ')
+
+    def __init__(self, serials=('emulator-5554', )):
+        self.serials = list(serials)
+        self.requests = []
+        self.files = {}
+        self._server = _AdbServer(('127.0.0.1', 0), _AdbHandler)
+        self._server.adb = self
+
+    @property
+    def address(self):
+        return 'localhost:%d' % self._server.server_address[1]
+
+    def shell(self, command):
+        p = subprocess.Popen(['sh', '-c', self.shell_functions + command],
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        return p.communicate()[0]
+
+    def start(self):
+        self._root = tempfile.mkdtemp(prefix='androidlibrary-device-')
+        self._device_dirs = _move_device_dirs(self._root)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        _restore_device_dirs(self._device_dirs)
+        shutil.rmtree(self._root, ignore_errors=True)
+
+
+def _write_executable(path, script):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        f.write(script)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH)
+
+
+# shell commands of a device, as far as the library uses them
+_DEVICE_FUNCTIONS = ('pm() { case "$1" in path) echo package:/data/app/$2-1.apk ;; *) echo Success ;; esac; }; '
+                     'getprop() { [ "$1" = init.svc.bootanim ] && echo stopped || echo 1; }; '
+                     'input() { :; }; md5sum() { return 1; }; '
+                     'am() { [ "$1" = instrument ] && exec sleep 5; }; ')
+
+_ADB = r'''#!/bin/sh
+FUNCTIONS='%s'
+[ "$1" = -s ] && shift 2
+[ "$1" = wait-for-device ] && shift
+case "$1" in
+  devices) printf 'List of devices attached\nemulator-5554\tdevice\n\n' ;;
+  install|uninstall) echo Success ;;
+  logcat)
+    [ "$2" = -c ] && exit 0
+    i=0
+    while echo "01-01 00:00:00.000  100  100 I Fake    : line $i"; do i=$((i + 1)); sleep 0.01; done ;;
+  shell)
+    shift
+    if [ $# -eq 0 ]; then
+      # persistent shell, reads commands from stdin
+      (echo "$FUNCTIONS"; exec cat) | exec sh
+    fi
+    exec sh -c "$FUNCTIONS $*" ;;
+esac
+exit 0
+''' % _DEVICE_FUNCTIONS.replace("'", "'\\''")
+
+_CALABASH = r'''#!/bin/sh
+if [ "$1" = extract-manifest ]; then
+  echo '<manifest package="com.example.app"><application><activity android:name=".MainActivity">'
+  echo '<intent-filter><action android:name="android.intent.action.MAIN"/></intent-filter></activity></application></manifest>'
+fi
+exit 0
+'''
+
+
+class fake_sdk(object):
+    '''
+    Context manager creating a temporary ANDROID_HOME with a fake `adb`,
+    whose shell runs commands on the local machine with stand-ins for the
+    Android tools, and `emulator` and `calabash-android` executables that
+    return right away. Yields the path to use as ANDROID_HOME,
+    `calabash-android` is put on $PATH. The directories the library writes
+    to on the device are moved into the fake SDK.
+    '''
+
+    adb = _ADB
+    emulator = '#!/bin/sh\nexit 0\n'
+    calabash = _CALABASH
+
+    def __enter__(self):
+        self.root = tempfile.mkdtemp(prefix='androidlibrary-sdk-')
+        for name, script in (('platform-tools/adb', self.adb),
+                             ('tools/emulator', self.emulator),
+                             ('bin/calabash-android', self.calabash)):
+            _write_executable(os.path.join(self.root, name), script)
+        self._old_path = os.environ.get('PATH', '')
+        os.environ['PATH'] = os.pathsep.join([os.path.join(self.root, 'bin'), self._old_path])
+        self._device_dirs = _move_device_dirs(os.path.join(self.root, 'device'))
+        return self.root
+
+    def __exit__(self, *exc_info):
+        _restore_device_dirs(self._device_dirs)
+        os.environ['PATH'] = self._old_path
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def _axml(package, activities, main_activity):
+    # string pool first, 'name' at index 0 for the resource map
+    strings = ['name', 'package', 'http://schemas.android.com/apk/res/android', 'manifest',
+               'application', 'activity', 'intent-filter', 'action', 'android.intent.action.MAIN',
+               package] + list(activities)
+    index = dict((string, i) for i, string in enumerate(strings))
+
+    data = ''
+    offsets = []
+    for string in strings:
+        offsets.append(len(data))
+        data += struct.pack('<H', len(string)) + string.encode('utf-16-le') + '\0\0'
+    data += '\0' * (-len(data) % 4)
+    header_size = 28
+    strings_start = header_size + 4 * len(strings)
+    pool = struct.pack('<HHIIIIII', 0x0001, header_size, strings_start + len(data),
+                       len(strings), 0, 0, strings_start, 0) + struct.pack('<%dI' % len(strings), *offsets) + data
+
+    resource_map = struct.pack('<HHII', 0x0180, 8, 12, 0x01010003)
+
+    namespace = index['http://schemas.android.com/apk/res/android']
+
+    def start(element, **attributes):
+        chunk = struct.pack('<IIHHHHHH', 0xffffffff, index[element], 20, 20, len(attributes), 0, 0, 0)
+        for attribute, value in attributes.items():
+            chunk += struct.pack('<IIIHBBI', namespace, index[attribute], index[value], 8, 0, 0x03, index[value])
+        return struct.pack('<HHIII', 0x0102, 16, 16 + len(chunk), 1, 0xffffffff) + chunk
+
+    def end(name):
+        return struct.pack('<HHIIIII', 0x0103, 16, 24, 1, 0xffffffff, 0xffffffff, index[name])
+
+    elements = start('manifest', package=package) + start('application')
+    for activity in activities:
+        elements += start('activity', name=activity)
+        if activity == main_activity:
+            elements += start('intent-filter') + start('action', name='android.intent.action.MAIN')
+            elements += end('action') + end('intent-filter')
+        elements += end('activity')
+    elements += end('application') + end('manifest')
+
+    body = pool + resource_map + elements
+    return struct.pack('<HHI', 0x0003, 8, 8 + len(body)) + body
+
+
+def write_apk(path, package='com.example.app', activities=('.MainActivity', ), main_activity=None):
+    '''
+    Writes an apk to `path` whose binary manifest declares `package` with the
+    given activities, the `main_activity` (default the first) handling the
+    MAIN action.
+    '''
+    if main_activity is None and activities:
+        main_activity = activities[0]
+    archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+    try:
+        archive.writestr('AndroidManifest.xml', _axml(package, activities, main_activity))
+        archive.writestr('classes.dex', '')
+    finally:
+        archive.close()
+    return path
@@ -0,0 +1,181 @@
+'''
+Offline benchmark suite for the overhead of the library itself.
+
+Runs the library against the stub instrumentation backend and the fake SDK
+of stub_backend and reports throughput and latency of the hot paths. With
+--history, the results are appended to a file of earlier runs and compared
+with the median of the last runs, the exit code is 1 if any benchmark got
+slower by more than --threshold percent.
+
+    python benchmarks/suite.py [--iterations N] [--history results.jsonl] [--threshold 25]
+'''
+
+import json
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from stub_backend import StubBackend, fake_sdk, write_apk
+
+from AndroidLibrary import AndroidLibrary
+
+
+def perform_action(library, backend, iterations):
+    for i in range(iterations):
+        start = time.time()
+        library.touch_text('Views')
+        yield time.time() - start
+
+
+def execute_with_timeout(library, backend, iterations):
+    for i in range(iterations):
+        start = time.time()
+        library._execute_with_timeout([library._adb, 'shell', 'true'], max_attempts=1)
+        yield time.time() - start
+
+
+def persistent_shell(library, backend, iterations):
+    for i in range(iterations):
+        start = time.time()
+        library._shell('getprop', 'sys.boot_completed')
+        yield time.time() - start
+
+
+def capture_screenshot(library, backend, iterations):
+    for i in range(iterations):
+        start = time.time()
+        library.capture_screenshot('benchmark.png')
+        yield time.time() - start
+
+
+def startup(library, backend, iterations):
+    '''
+    Importing the library and starting and connecting to the test server
+    '''
+    apk = write_apk(os.path.join(library._get_log_dir(), 'app.apk'))
+    for i in range(iterations):
+        start = time.time()
+        library = AndroidLibrary(library._ANDROID_HOME)
+        library.set_device_url(backend.url)
+        library.start_testserver_with_apk(apk)
+        library.wait_for_testserver()
+        yield time.time() - start
+        library._device.testserver_proc.kill()
+        library._device.testserver_proc.wait()
+
+
+BENCHMARKS = [
+    ('perform_action', perform_action, 1),
+    ('execute_with_timeout', execute_with_timeout, 0.2),
+    ('persistent_shell', persistent_shell, 1),
+    ('capture_screenshot', capture_screenshot, 1),
+    ('startup', startup, 0.1),
+]
+
+
+def statistics(timings):
+    timings = sorted(timings)
+    return {
+        'iterations': len(timings),
+        'per_second': len(timings) / sum(timings),
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'p50_ms': timings[len(timings) // 2] * 1000,
+        'p95_ms': timings[min(int(len(timings) * 0.95), len(timings) - 1)] * 1000,
+    }
+
+
+def run(iterations):
+    results = {}
+    backend = StubBackend().start()
+    directory = tempfile.mkdtemp(prefix='androidlibrary-benchmark-')
+    try:
+        with fake_sdk() as android_home:
+            for name, benchmark, share in BENCHMARKS:
+                library = AndroidLibrary(android_home)
+                library._get_log_dir = lambda: directory
+                library.set_device_url(backend.url)
+                library.connect_to_testserver()
+                try:
+                    results[name] = statistics(list(benchmark(library, backend, max(int(iterations * share), 1))))
+                finally:
+                    library._close_shell()
+    finally:
+        backend.stop()
+        shutil.rmtree(directory)
+    return results
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def regressions(results, history, threshold, runs=5):
+    '''
+    Compares the median latency of each benchmark with the median of the
+    last `runs` runs in `history`. Returns (name, baseline, now) for every
+    benchmark that got slower by more than `threshold` percent.
+    '''
+    slower = []
+    for name, stats in sorted(results.items()):
+        earlier = sorted(run['results'][name]['p50_ms'] for run in history[-runs:] if name in run['results'])
+        if not earlier:
+            continue
+        baseline = earlier[len(earlier) // 2]
+        if stats['p50_ms'] > baseline * (1 + threshold / 100.0):
+            slower.append((name, baseline, stats['p50_ms']))
+    return slower
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--iterations', type='int', default=500,
+                      help='iterations of the fastest benchmarks, slower ones run fewer')
+    parser.add_option('--history', help='file with the results of earlier runs, the results are appended')
+    parser.add_option('--threshold', type='float', default=25,
+                      help='percent by which the median latency may grow before it counts as regression')
+    options, args = parser.parse_args()
+
+    results = run(options.iterations)
+    print '%-22s %10s %10s %10s %10s' % ('', 'per second', 'mean ms', 'p50 ms', 'p95 ms')
+    for name, benchmark, share in BENCHMARKS:
+        stats = results[name]
+        print '%-22s %10.1f %10.3f %10.3f %10.3f' % (
+            name, stats['per_second'], stats['mean_ms'], stats['p50_ms'], stats['p95_ms'])
+
+    if not options.history:
+        return 0
+
+    history = load_history(options.history)
+    slower = regressions(results, history, options.threshold)
+    with open(options.history, 'a') as f:
+        f.write(json.dumps({
+            'time': time.time(),
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results,
+        }) + '\n')
+
+    for name, baseline, now in slower:
+        print 'REGRESSION %s: median %.3fms, was %.3fms' % (name, now, baseline)
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+'''
+Measures bytes transferred per `Webview Should Contain` and `Get Webview
+Element Count` when the test server evaluates the query in the webview,
+compared to fetching the whole document with the `query` action, as test
+servers without `execute_javascript` require.
+
+    python benchmarks/webview.py [document size in KB] [iterations]
+'''
+
+import json
+import sys
+
+from stub_backend import StubBackend, fake_sdk
+
+from AndroidLibrary import AndroidLibrary
+
+
+class WebviewBackend(StubBackend):
+
+    def __init__(self, document, javascript=True):
+        StubBackend.__init__(self)
+        self.document = document
+        self.javascript = javascript
+
+    def respond(self, action):
+        if action['command'] == 'execute_javascript':
+            if not self.javascript:
+                return {"success": False, "message": "Unknown command: execute_javascript", "bonusInformation": []}
+            result = 'true' if 'indexOf' in action['arguments'][0] and 'filter' not in action['arguments'][0] else '3'
+            return {"success": True, "message": '{"result": %s}' % result, "bonusInformation": []}
+        if action['command'] == 'query':
+            # the query action returns every matched element with its whole text and markup
+            return [{"textContent": self.document, "html": '<p>%s</p>' % self.document,
+                     "nodeName": "HTML", "id": "", "class": "", "rect": {}}]
+        return StubBackend.respond(self, action)
+
+
+def measure(library, backend, keyword, iterations):
+    library._timings.clear()
+    del backend.actions[:]
+    for i in range(iterations):
+        keyword()
+    received = sum(record[6] for record in library._timings.records if record[0] == 'action')
+    sent = sum(len(json.dumps(action)) for action in backend.actions)
+    return sent / iterations, received / iterations
+
+
+def main(size=1024, iterations=20):
+    document = ('Lorem ipsum dolor sit amet. ' * (size * 1024 // 28 + 1))[:size * 1024 - 8] + 'Checkout'
+    with fake_sdk() as android_home:
+        for javascript in (False, True):
+            backend = WebviewBackend(document, javascript).start()
+            try:
+                library = AndroidLibrary(android_home)
+                library.set_device_url(backend.url)
+                for name, keyword in (
+                        ('Webview Should Contain', lambda: library.webview_should_contain('Checkout')),
+                        ('Get Webview Element Count', lambda: library.get_webview_element_count('css=p', 'Lorem')),
+                ):
+                    sent, received = measure(library, backend, keyword, iterations)
+                    print '%-26s %-16s %9d bytes sent %11d bytes received per assertion' % (
+                        name, 'execute_javascript' if javascript else 'whole document', sent, received)
+            finally:
+                backend.stop()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -27,7 +27,7 @@ setup(
   zip_safe         = False,
   classifiers      = CLASSIFIERS.splitlines(),
   package_dir      = {'' : 'src'},
-  install_requires = ['robotframework', 'requests'],
+  install_requires = ['robotframework>=2.8.5', 'requests'],
   packages         = ['AndroidLibrary'],
   package_data     = {'AndroidLibrary': ['src/AndroidLibrary/*.jar']}
 )
@@ -1,10 +1,18 @@
+import itertools
 import json
 import logging
+import math
 import os
+import random
 import subprocess
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 import requests
-from urlparse import urlparse, urljoin
+from requests.adapters import HTTPAdapter
+from urlparse import urljoin, urlparse
 from xml.dom import minidom
+from xml.parsers.expat import ExpatError
 from version import VERSION
 
 __version__ = VERSION
@@ -12,9 +20,38 @@ __version__ = VERSION
 import robot
 from robot.variables import GLOBAL_VARIABLES
 from robot.api import logger
+from robot.utils import ConnectionCache
 
 import killableprocess
-import tempfile
+from actionlog import Abbreviated, ActionLog
+from device import Device, DevicePool
+from emulatorpool import EmulatorPool
+from boot import BootWaiter
+from adbshell import AdbShell, AdbShellError
+from adbclient import AdbClient, AdbClientShell
+from installcache import InstallCache
+from axml import AxmlError, apk_main_activity
+from logcat import LogcatCollector
+from screencache import ScreenCache
+from screenrecord import ScreenRecorder
+from timing import TimingListener, Timings
+from viewtree import ViewSnapshot, mutates
+import webview
+from screenshots import CHUNK_SIZE, ScreenshotOptions, ScreenshotWriter, same_screen, screen_signature
+
+
+def _is_true(value):
+    if isinstance(value, basestring):
+        return value.lower() not in ('false', 'no', '0', '')
+    return bool(value)
+
+
+def _as_list(value):
+    if not value:
+        return []
+    if isinstance(value, basestring):
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return list(value)
 
 
 class AndroidLibrary(object):
@@ -22,26 +59,79 @@ class AndroidLibrary(object):
     ROBOT_LIBRARY_VERSION = VERSION
     ROBOT_LIBRARY_SCOPE = 'GLOBAL'
 
-    def __init__(self, ANDROID_HOME=None):
+    def __init__(self, ANDROID_HOME=None, http_pool_size=4, http_retries=0, device_lock_dir=None,
+                 adb_server=None, install_cache=True, timing_report=None):
         '''
         Path to the Android SDK.
         Optional if the $ANDROID_HOME environment variable is set.
+
+        `http_pool_size` number of keep-alive connections kept open to the
+        instrumentation backend. Set to 0 to open a new connection for
+        every request.
+
+        `http_retries` how often a request is retried when the connection to
+        the instrumentation backend could not be established.
+
+        `device_lock_dir` directory in which `Claim Device` records which
+        devices are in use. All test processes sharing devices must use the
+        same directory, defaults to a directory in the system's temp dir.
+
+        `adb_server` address of the adb server as 'host:port', e.g.
+        'localhost:5037'. If given, shell commands, installs and port
+        forwards are sent to the adb server directly instead of starting the
+        adb executable for each of them.
+
+        `install_cache` if true, `Install Application` does nothing if the
+        exact same apk is already installed on the device. A fingerprint of
+        every installed apk is kept on the device for that.
+
+        `timing_report` path, relative to the output directory, to which the
+        durations of all keywords, adb commands and HTTP requests are
+        written when the test run ends, as `timing_report`.json and
+        `timing_report`.csv. The summary is also added to the metadata of
+        the top level suite, which shows it as a table in the log and the
+        report. See `Log Timings` and `Export Timings`.
         '''
 
         if ANDROID_HOME is None:
             ANDROID_HOME = os.environ['ANDROID_HOME']
 
         self._ANDROID_HOME = ANDROID_HOME
-        self._screenshot_index = 0
+        # counters are shared by keywords running in several threads,
+        # next() on them is atomic
+        self._screenshot_counter = itertools.count(1)
+        self._screenshot_options = ScreenshotOptions()
+        self._screenshot_writer = None
+        self._recording_counter = itertools.count(1)
+        self._action_log = ActionLog()
+        self._timings = Timings()
+        self._local = threading.local()
+        self._background = None
+        self._background_jobs = {}
+        self._background_ids = itertools.count(1)
+        self._screen_cache = None
+        self._timing_report = timing_report
+        keywords = set(name.replace('_', '') for name in dir(self)
+                       if not name.startswith('_') and callable(getattr(self, name)))
+        self.ROBOT_LIBRARY_LISTENER = TimingListener(self._timings, keywords, self._timing_report_path)
 
         self._adb = self._sdk_path(['platform-tools/adb',
                                     'platform-tools/adb.exe'])
         self._emulator = self._sdk_path(['tools/emulator',
                                          'tools/emulator.exe'])
-        self._url = None
-        self._testserver_proc = None
+        self._devices = ConnectionCache('No device registered.')
+        self._devices.register(Device())
         self._username = None
         self._password = None
+        self._http_pool_size = int(http_pool_size)
+        self._http_retries = int(http_retries)
+        self._device_pool = DevicePool(device_lock_dir)
+        self._emulator_pool = None
+        self._adb_client = None
+        if adb_server:
+            host, _, port = adb_server.rpartition(':')
+            self._adb_client = AdbClient(host or 'localhost', int(port))
+        self._install_cache = InstallCache() if _is_true(install_cache) else None
         self._calabash_bin_path = self._env_command(['calabash-android.bat',
                                                      'calabash-android'])
 
@@ -64,16 +154,138 @@ class AndroidLibrary(object):
                     return exe_file
         raise AssertionError("Couldn't find binary %s" % os.path.commonprefix(commands))
 
+    @property
+    def _device(self):
+        # keywords run by Run Keyword On Devices act on their own device
+        return getattr(self._local, 'device', None) or self._devices.current
+
+    @property
+    def _action_batch(self):
+        # every thread has its own batch, actions of keywords running in the
+        # background are not queued into a batch of the test
+        return getattr(self._local, 'action_batch', None)
+
+    @_action_batch.setter
+    def _action_batch(self, batch):
+        self._local.action_batch = batch
+
+    def _info(self, message, html=False):
+        '''
+        Logs to the Robot log. Robot drops messages from other threads, those
+        of keywords run in the background are kept and logged when their
+        results are collected.
+        '''
+        messages = getattr(self._local, 'messages', None)
+        if messages is None:
+            logger.info(message, html)
+        else:
+            messages.append((message, html))
+
+    # The helpers below act on the current device unless another one is
+    # passed as `device`, which keywords working on several devices at once
+    # do from worker threads.
+
+    def _adb_command(self, *args, **kwargs):
+        device = kwargs.get('device') or self._device
+        cmd = [self._adb]
+        if device.serial is not None:
+            cmd.extend(['-s', device.serial])
+        cmd.extend(args)
+        return cmd
+
+    def _adb_execute(self, *args, **kwargs):
+        '''
+        Runs an adb command for the device, through the adb server directly
+        if `adb_server` was given. Returns (rc, output, errput) like
+        _execute_with_timeout, which takes the same keyword arguments.
+        '''
+        device = kwargs.pop('device', None) or self._device
+        if self._adb_client is not None:
+            started = time.time()
+            try:
+                rc, output, errput = self._adb_client.execute(device.serial, args,
+                                                              timeout=kwargs.get('max_timeout', 120))
+            except NotImplementedError:
+                pass
+            else:
+                self._timings.record('adb', self._command_name(('adb', ) + args), started, rc, 1,
+                                     len(output) + len(errput))
+                return rc, output, errput
+        return self._execute_with_timeout(self._adb_command(device=device, *args), **kwargs)
+
+    def _get_shell(self, device=None):
+        device = device or self._device
+        if device.shell is None:
+            if self._adb_client is not None:
+                device.shell = AdbClientShell(self._adb_client, device.serial)
+            else:
+                device.shell = AdbShell(self._adb_command(device=device))
+        return device.shell
+
+    def _close_shell(self):
+        if self._device.shell is not None:
+            self._device.shell.close()
+            self._device.shell = None
+
+    def _shell(self, *args, **kwargs):
+        '''
+        Runs a shell command on the device through its persistent adb shell,
+        falls back to a separate `adb shell` process if that fails. Returns
+        (rc, output, errput) like _execute_with_timeout.
+        '''
+        max_timeout = kwargs.get('max_timeout', 120)
+        device = kwargs.get('device')
+        started = time.time()
+        try:
+            rc, output = self._get_shell(device).run(' '.join(args), timeout=max_timeout)
+            self._timings.record('shell', args[0].split(' ', 1)[0], started, rc, 1, len(output))
+            return rc, output, ''
+        except AdbShellError, e:
+            logging.warn("Persistent adb shell failed, running '%s' in a new adb process: %s" % (
+                ' '.join(args), e))
+        return self._adb_execute('shell', max_attempts=1, max_timeout=max_timeout, device=device, *args)
+
     def _request(self, method, url, *args, **kwargs):
 
         if self._username is not None and self._password is not None:
             kwargs['auth'] = (self._username, self._password)
 
-        logging.debug(">> %r %r", args, kwargs)
-        response = getattr(requests, method)(url, *args, **kwargs)
-
+        logging.debug(">> %s %s", method.upper(), url)
+        started = time.time()
+        try:
+            if self._http_pool_size > 0:
+                response = self._get_session().request(method, url, *args, **kwargs)
+            else:
+                response = getattr(requests, method)(url, *args, **kwargs)
+        except requests.exceptions.RequestException:
+            self._timings.record('http', '%s /%s' % (method.upper(), urlparse(url).path.lstrip('/')), started)
+            raise
+
+        size = response.headers.get('Content-Length')
+        self._timings.record('http', '%s /%s' % (method.upper(), urlparse(url).path.lstrip('/')), started,
+                             response.status_code, 1, int(size) if size else None)
         return response
 
+    def _get_session(self):
+        if self._device.session is None:
+            self._open_session()
+        return self._device.session
+
+    def _open_session(self):
+        self._close_session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self._http_pool_size,
+                              max_retries=self._http_retries)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self._device.session = session
+
+    def _close_session(self):
+        if self._device.session is not None:
+            self._device.session.close()
+            self._device.session = None
+
     def set_basic_auth(self, username, password):
         '''
         Set basic authentication to use with all further API calls
@@ -86,12 +298,17 @@ class AndroidLibrary(object):
         self._password = password
 
     def start_emulator(self, avd_name, no_window=False,
-                       language="en", country="us", save_snapshot=False, retries=3, http_proxy=""):
+                       language="en", country="us", save_snapshot=False, retries=3, http_proxy="",
+                       boot_timeout=300):
         '''
-        Starts the Android Emulator.
+        Starts the Android Emulator and waits until it has booted, see `Wait Until Device Is Ready`.
 
         `avd_name` Identifier of the Android Virtual Device, for valid values on your machine run "$ANDROID_HOME/tools/android list avd|grep Name`
         `no_window` Set to True to start the emulator without GUI, useful for headless environments.
+        `retries` how often to restart the emulator if it did not boot within `boot_timeout` seconds
+
+        If the current device was registered with a serial like
+        "emulator-5556", the emulator is started on that console port.
         '''
         lang = "persist.sys.language=%s" % language
         co = "persist.sys.country=%s" % country
@@ -107,84 +324,213 @@ class AndroidLibrary(object):
             args.append('-http-proxy')
             args.append(http_proxy)
 
-        logging.debug("$> %s", ' '.join(args))
+        if self._device.emulator_port is not None:
+            args.extend(['-port', str(self._device.emulator_port)])
 
-        self._emulator_proc = subprocess.Popen(args)
-        rc, output, errput = self._execute_with_timeout([self._adb, 'wait-for-device'], max_timeout=80, max_attempts=1)
-        if rc != 0 and retries > 0:
+        retries = int(retries)
+        while True:
+            logging.debug("$> %s", ' '.join(args))
+            self._device.emulator_proc = subprocess.Popen(args)
+            try:
+                self.wait_until_device_is_ready(boot_timeout)
+                return
+            except AssertionError:
                 self.stop_emulator()
-                logging.warn("adb did not respond, retry starting %s " % retries)
-                self.start_emulator(avd_name, no_window, language, country, save_snapshot, retries - 1)
+                if retries <= 0:
+                    raise
+                logging.warn("Emulator did not boot, retry starting %s " % retries)
+                retries -= 1
 
     def stop_emulator(self):
         '''
         Halts a previously started Android Emulator.
         '''
 
-        if not hasattr(self, '_emulator_proc'):
+        if self._device.emulator_proc is None:
             logging.warn("Could not stop Android Emulator: It was not started.")
             return
 
-        self._emulator_proc.terminate()
-        self._emulator_proc.kill()
-        self._emulator_proc.wait()
-        self._emulator_proc = None
+        self._close_shell()
+
+        self._device.emulator_proc.terminate()
+        self._device.emulator_proc.kill()
+        self._device.emulator_proc.wait()
+        self._device.emulator_proc = None
+
+    def start_emulator_pool(self, avd_name, size=2, snapshot=None, no_window=False,
+                            base_port=5554, boot_timeout=300):
+        '''
+        Boots several emulators at once to be handed out with `Lease Emulator`.
+
+        Starting the pool once, e.g. in the setup of the top level suite, and
+        leasing an emulator per suite avoids paying the boot time in every
+        suite.
+
+        `avd_name` Identifier of the Android Virtual Device all emulators are started from
+        `size` number of emulators to start
+        `snapshot` name of an emulator snapshot to boot from and to reset leased emulators to, a cold boot takes much longer
+        `no_window` Set to True to start the emulators without GUI
+        `base_port` console port of the first emulator, the following ones use the next even ports
+        `boot_timeout` seconds to wait for each emulator to boot
+        '''
+        assert self._emulator_pool is None, "An emulator pool was already started"
+
+        emulator_args = []
+        if _is_true(no_window):
+            emulator_args.append('-no-window')
+
+        pool = EmulatorPool(self._emulator, self._adb, self._execute_with_timeout,
+                            avd_name, int(size), int(base_port), snapshot or None,
+                            emulator_args, int(boot_timeout))
+        try:
+            pool.start()
+        except:
+            pool.stop()
+            raise
+        self._emulator_pool = pool
+
+    def lease_emulator(self, alias=None):
+        '''
+        Takes a free emulator from the pool started with `Start Emulator Pool`
+        and makes it the current device. Returns its serial.
+
+        The test server of the n-th emulator of the pool is reached through
+        local port 34777 + n.
+
+        `alias` name to use with `Switch Device`, defaults to the serial
+        '''
+        assert self._emulator_pool is not None, "No emulator pool was started, use 'Start Emulator Pool' first"
+
+        instance = self._emulator_pool.lease()
+        port = 34777 + self._emulator_pool.instances.index(instance)
+        device = Device(instance.serial, 'http://localhost:%d/' % port)
+        device.lease = instance
+        self._devices.register(device, alias or instance.serial)
+        return instance.serial
+
+    def release_emulator(self, reset=None, *packages):
+        '''
+        Resets the current device and returns it to the emulator pool.
+
+        `reset` how to reset the emulator for the next lease:
+        'snapshot' reloads the snapshot the pool was started from,
+        'clear' clears the data of the given packages,
+        'uninstall' uninstalls the given packages,
+        'none' leaves it as it is.
+        Defaults to 'snapshot' if the pool was started from a snapshot, to 'none' otherwise.
+
+        | Release Emulator | clear | com.example.android.apis |
+        '''
+        assert self._device.lease is not None, "The current device was not leased with 'Lease Emulator'"
+        reset = reset or None
+        self._emulator_pool.reset_commands(reset, packages)
+
+        lease, self._device.lease = self._device.lease, None
+        try:
+            self._close_session()
+            self._close_shell()
+        finally:
+            self._emulator_pool.release(lease, reset, packages)
+
+    def get_emulator_pool_status(self):
+        '''
+        Returns and logs serial, boot time in seconds, health and number of
+        leases and restarts of every emulator in the pool.
+        '''
+        assert self._emulator_pool is not None, "No emulator pool was started, use 'Start Emulator Pool' first"
+
+        status = [instance.status() for instance in self._emulator_pool.instances]
+        for instance in status:
+            self._info("%(serial)s: booted in %(boot_time).1fs, healthy: %(healthy)s, "
+                        "leased: %(leased)s, %(leases)d leases, %(restarts)d restarts" % instance)
+        return status
+
+    def stop_emulator_pool(self):
+        '''
+        Halts all emulators of the pool started with `Start Emulator Pool`.
+        '''
+        if self._emulator_pool is None:
+            logging.warn("Could not stop emulator pool: It was not started.")
+            return
+
+        self._emulator_pool.stop()
+        self._emulator_pool = None
+
+    def _command_name(self, cmd):
+        '''
+        Name of the command for timings, e.g. "adb shell pm" for
+        ['.../adb', '-s', 'emulator-5554', 'shell', 'pm', 'path', 'android']
+        '''
+        name = [os.path.splitext(os.path.basename(cmd[0]))[0]]
+        args = list(cmd[1:])
+        while args[:1] in (['-s'], ['wait-for-device']):
+            args = args[2:] if args[0] == '-s' else args[1:]
+        name.extend(args[:2] if args[:1] == ['shell'] else args[:1])
+        return ' '.join(name)
 
     def _execute_with_timeout(self, cmd, max_attempts=3, max_timeout=120):
         logging.debug("$> %s # with timeout %ds", ' '.join(cmd), max_timeout)
+        started = time.time()
 
         attempt = 0
 
         while attempt < max_attempts:
             attempt = attempt + 1
-            out = tempfile.NamedTemporaryFile(delete=False)
-            err = tempfile.NamedTemporaryFile(delete=False)
-            p = killableprocess.Popen(cmd, stdout=out, stderr=err)
-            p.wait(max_timeout)
-            out.flush()
-            out.close()
-            err.flush()
-            err.close()
+            p = killableprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = p.capture(max_timeout)
 
             # -9 and 127 are returned by killableprocess when a timeout happens
             if  p.returncode == -9 or p.returncode == 127:
                 logging.warn("Executing %s failed executing in less then %d seconds and was killed, attempt number %d of %d" % (
                     ' '.join(cmd), max_timeout, attempt, max_attempts))
-                continue
+                if attempt < max_attempts:
+                    out.close()
+                    err.close()
+                    continue
+            break
 
         try:
-            outfile = open(out.name, 'r')
-            errfile = open(err.name, 'r')
-            return p.returncode, outfile.read(), errfile.read()
+            output, errput = out.read(), err.read()
         finally:
-            outfile.close()
-            os.unlink(out.name)
-            errfile.close()
-            os.unlink(errfile.name)
+            out.close()
+            err.close()
 
-    def _wait_for_package_manager(self):
-        attempts = 0
-        max_attempts = 3
+        self._timings.record('adb' if cmd[0] == self._adb else 'process', self._command_name(cmd), started,
+                             p.returncode, attempt, len(output) + len(errput))
+        return p.returncode, output, errput
 
-        while attempts < max_attempts:
-            rc, output, errput = self._execute_with_timeout([
-                self._adb, "wait-for-device", "shell", "pm", "path", "android"],
-                max_timeout=60, max_attempts=3)
-            assert rc == 0, "Waiting for package manager failed: %d, %r, %r" % (rc, output, errput)
+    def _wait_for_package_manager(self, device=None):
+        BootWaiter(self._adb_command(device=device), self._execute_with_timeout,
+                   self._get_shell(device)).wait(timeout=180, phases=('package_manager', ))
 
-            if not 'Could not access the Package Manager.' in output:
-                return
+    def wait_until_device_is_ready(self, timeout=300):
+        '''
+        Waits until the device has booted completely and its package manager
+        is running. Returns and logs how many seconds each boot phase took.
 
-        raise AssertionError(output)
+        Unlike `Wait For Device`, which returns as soon as adb can reach the
+        device, this polls the boot_completed flag, the end of the boot
+        animation and the package manager.
+
+        `timeout` seconds to wait for all phases together
+        '''
+        timings = BootWaiter(self._adb_command(), self._execute_with_timeout,
+                             self._get_shell()).wait(float(timeout))
+        self._info("Device ready after %.1fs: %s" % (
+            sum(seconds for phase, seconds in timings),
+            ', '.join('%s %.1fs' % timing for timing in timings)))
+        return timings
 
     def uninstall_application(self, package_name):
         self._wait_for_package_manager()
 
-        rc, output, errput = self._execute_with_timeout([self._adb, "uninstall", package_name])
+        rc, output, errput = self._adb_execute("uninstall", package_name)
         assert rc == 0, "Uninstalling application failed: %d, %r" % (rc, output)
         assert output is not None
         logging.debug(output)
         assert 'Error' not in output, output
+        if self._install_cache is not None:
+            self._install_cache.forget(self._shell_runner(), package_name)
 
     def install_application(self, apk_file):
         '''
@@ -193,23 +539,286 @@ class AndroidLibrary(object):
         For instrumentation (and thus all remote keywords to work) both .apk
         files must be signed with the same key.
 
+        If the install cache is enabled (see importing), nothing is done when
+        the exact same apk is already installed. Apks whose package name can
+        not be read are always installed.
+
         `apk_file` Path the the application to install
         '''
+        package_name = self._cached_package_name(apk_file)
+        if not self._install(apk_file, package_name=package_name):
+            self._info("%s is already installed" % apk_file)
 
-        self._wait_for_package_manager()
+    def reinstall_application(self, apk_file):
+        '''
+        Makes sure the application is installed without any data, as
+        `Uninstall Application` followed by `Install Application` would.
 
-        rc, output, errput = self._execute_with_timeout([self._adb, "install", "-r", apk_file], max_timeout=240)
+        If the exact same apk is already installed, only its data is cleared,
+        which is much faster than installing it again.
+
+        `apk_file` Path the the application to install
+
+        | Reinstall Application | ${APP_APK} |
+        '''
+        package_name = self._main_activity_from_apk(apk_file)[0]
+        if self._install_cache is not None:
+            self._wait_for_package_manager()
+            if self._install_cache.is_installed(self._shell_runner(), package_name,
+                                                self._install_cache.digest(apk_file)):
+                self._info("%s is already installed, clearing its data" % apk_file)
+                self.clear_app_data(package_name)
+                return
+
+        rc, output, errput = self._adb_execute("uninstall", package_name)
+        logging.debug(output)
+        self._install(apk_file, package_name=package_name, skip_installed=False)
+
+    def clear_app_data(self, package_name):
+        '''
+        Deletes all data of the application, as if it was freshly installed.
+
+        `package_name` package of the application, e.g. com.example.app
+
+        | Clear App Data | com.example.app |
+        '''
+        rc, output, errput = self._shell('pm', 'clear', package_name)
+        assert rc == 0 and 'Success' in output, "Clearing data of %s failed: %d, %r" % (
+            package_name, rc, output)
+
+    def _shell_runner(self, device=None):
+        '''
+        Returns a function running a shell command on the device and
+        returning (rc, output), as InstallCache expects.
+        '''
+        return lambda command: self._shell(command, device=device)[:2]
+
+    def _cached_package_name(self, apk_file):
+        '''
+        Returns the package name of the apk for the install cache, None if
+        the cache is disabled or the manifest can not be read.
+        '''
+        if self._install_cache is None:
+            return None
+        try:
+            return self._main_activity_from_apk(apk_file)[0]
+        except AssertionError, e:
+            logging.warn("Installing %s without the install cache: %s" % (apk_file, e))
+            return None
+
+    def _install(self, apk_file, device=None, package_name=None, skip_installed=True):
+        '''
+        Installs the apk on the device. If the package_name is given and the
+        install cache is enabled, nothing is done when the same apk is already
+        installed. Returns whether the apk was installed.
+        '''
+        self._wait_for_package_manager(device)
+
+        cache = self._install_cache if package_name is not None else None
+        if cache is not None:
+            digest = cache.digest(apk_file)
+            if skip_installed and cache.is_installed(self._shell_runner(device), package_name, digest):
+                logging.debug("%s is already installed", apk_file)
+                return False
+
+        rc, output, errput = self._adb_execute("install", "-r", apk_file, max_timeout=240, device=device)
         logging.debug(output)
         assert rc == 0, "Installing application failed: %d, %r" % (rc, output)
         assert output is not None
         assert 'Error' not in output, output
 
+        if cache is not None:
+            cache.record(self._shell_runner(device), package_name, digest)
+        return True
+
+    def _keyword(self, name):
+        method = getattr(self, name.lower().replace(' ', '_'), None)
+        assert not name.startswith('_') and callable(method), "No keyword '%s' in AndroidLibrary" % name
+        return method
+
+    def _run_on_device(self, device, keyword, args):
+        '''
+        Runs the keyword with `device` as the current device of this thread.
+        Returns ('PASS', result, messages) or ('FAIL', error, messages).
+        '''
+        self._local.device = device
+        messages = self._local.messages = []
+        try:
+            return 'PASS', keyword(*args), messages
+        except AssertionError, e:
+            return 'FAIL', str(e), messages
+        except Exception, e:
+            return 'FAIL', '%s: %s' % (type(e).__name__, e), messages
+        finally:
+            self._local.device = None
+            self._local.messages = None
+
+    def _replay_messages(self, messages):
+        for message, html in messages:
+            self._info(message, html)
+
+    def _devices_by_alias(self, aliases):
+        '''
+        Returns (alias, device) of the devices registered as `aliases`, a
+        list or comma separated string. The current device stays the same.
+        '''
+        current = self._devices.current
+        targets = []
+        try:
+            for alias in _as_list(aliases):
+                try:
+                    self._devices.switch(alias)
+                except RuntimeError:
+                    raise AssertionError("No device registered as '%s'" % alias)
+                targets.append((alias, self._devices.current))
+        finally:
+            self._devices.current = current
+        return targets
+
+    def run_keyword_on_devices(self, devices, keyword, *args):
+        '''
+        Runs a keyword of this library on several devices at the same time,
+        each in its own thread. Returns the list of the keyword's results, in
+        the order of the devices.
+
+        Fails after all devices are done if the keyword failed on any of them.
+
+        `devices` list of aliases of devices registered with `Register Device`, `Claim Device` or `Lease Emulator`, or a comma separated string
+        `keyword` name of the keyword, e.g. Capture Screenshot
+        `args` arguments of the keyword
+
+        | @{results}= | Run Keyword On Devices | phone, tablet | Touch Text | Login |
+        '''
+        method = self._keyword(keyword)
+        targets = self._devices_by_alias(devices)
+        assert targets, "At least one device must be given"
+
+        pool = ThreadPool(len(targets))
+        try:
+            results = pool.map(lambda target: self._run_on_device(target[1], method, args), targets)
+        finally:
+            pool.close()
+            pool.join()
+
+        failures = []
+        for (alias, device), (status, result, messages) in zip(targets, results):
+            self._replay_messages(messages)
+            if status == 'FAIL':
+                failures.append('%s: %s' % (alias, result))
+        assert not failures, "%s failed on %d of %d devices: %s" % (
+            keyword, len(failures), len(targets), '; '.join(failures))
+        return [result for status, result, messages in results]
+
+    def start_keyword_in_background(self, keyword, *args):
+        '''
+        Starts a keyword of this library in a background thread, on the
+        current device, and returns right away. Use `Wait For Background
+        Keyword` with the returned id to wait for it and get its result.
+
+        Allows slow operations like installing an app or taking screenshots
+        to overlap with other keywords. Keywords running in the background
+        should not use the same device as the test in the meantime.
+
+        `keyword` name of the keyword, e.g. Install Application
+        `args` arguments of the keyword
+
+        | ${install}= | Start Keyword In Background | Install Application | ${APP_APK} |
+        | Capture Screenshot |
+        | Wait For Background Keyword | ${install} |
+        '''
+        method = self._keyword(keyword)
+        if self._background is None:
+            self._background = ThreadPool(8)
+        job = next(self._background_ids)
+        self._background_jobs[job] = (keyword, self._background.apply_async(
+            self._run_on_device, (self._device, method, args)))
+        return job
+
+    def wait_for_background_keyword(self, job, timeout=None):
+        '''
+        Waits for a keyword started with `Start Keyword In Background` and
+        returns its result. Fails if the keyword failed.
+
+        `job` id returned by `Start Keyword In Background`
+        `timeout` seconds to wait at most, waits until the keyword is done by default
+        '''
+        job = int(job)
+        assert job in self._background_jobs, "No background keyword with id %s" % job
+        keyword, result = self._background_jobs[job]
+        result.wait(float(timeout) if timeout else None)
+        assert result.ready(), "%s did not finish within %ss" % (keyword, timeout)
+        del self._background_jobs[job]
+
+        status, value, messages = result.get()
+        self._replay_messages(messages)
+        assert status == 'PASS', "%s failed: %s" % (keyword, value)
+        return value
+
+    def install_applications(self, apks, devices=None, max_workers=4, skip_installed=True):
+        '''
+        Installs several applications on several devices at the same time.
+
+        Returns and logs how long every install took.
+
+        `apks` list of paths of the apk files, or a comma separated string
+        `devices` list of aliases of devices registered with `Register Device`, `Claim Device` or `Lease Emulator`, defaults to the current device
+        `max_workers` maximum number of installs running at the same time
+        `skip_installed` do not install an apk if the exact same file is already installed on the device, needs the install cache (see importing)
+
+        | Install Applications | ${TEST_SERVER_APK}, ${APP_APK} | phone, tablet |
+        '''
+        apks = _as_list(apks)
+        assert apks, "At least one apk must be given"
+        targets = [(None, self._device)]
+        if devices:
+            targets = self._devices_by_alias(devices)
+
+        skip_installed = _is_true(skip_installed)
+        packages = {}
+        for apk in apks:
+            packages[apk] = self._cached_package_name(apk)
+
+        def install(job):
+            alias, device, apk = job
+            started = time.time()
+            try:
+                installed = self._install(apk, device, packages[apk], skip_installed)
+                error = None
+            except AssertionError, e:
+                installed, error = False, str(e)
+            return {
+                'device': alias or device.serial,
+                'apk': apk,
+                'installed': installed,
+                'seconds': time.time() - started,
+                'error': error,
+            }
+
+        jobs = [(alias, device, apk) for alias, device in targets for apk in apks]
+        pool = ThreadPool(min(int(max_workers), len(jobs)))
+        try:
+            results = pool.map(install, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+        for result in results:
+            state = result['error'] or ('installed' if result['installed'] else 'already installed')
+            self._info("%s on %s: %s in %.1fs" % (
+                os.path.basename(result['apk']), result['device'], state, result['seconds']))
+
+        failed = [result for result in results if result['error']]
+        assert not failed, "Installing %d of %d applications failed: %s" % (
+            len(failed), len(results), '; '.join(
+                '%s on %s: %s' % (result['apk'], result['device'], result['error']) for result in failed))
+        return results
+
     def wait_for_device(self, timeout=120):
         '''
         Wait for the device to become available
         '''
-        rc, output, errput = self._execute_with_timeout([self._adb, 'wait-for-device'], max_timeout=timeout / 3, max_attempts=3)
-        assert rc == 0, "wait for device application failed: %d, %r" % (rc, output)
+        rc, output, errput = self._adb_execute('wait-for-device', max_timeout=timeout / 3, max_attempts=3)
+        assert rc == 0, "wait for device application failed: %d, %r" % (rc, errput or output)
 
     def send_key(self, key_code):
         '''
@@ -217,20 +826,23 @@ class AndroidLibrary(object):
 
         `key_code` The key code to send
         '''
-        rc, output, errput = self._execute_with_timeout([self._adb, 'shell', 'input', 'keyevent', '%d' % key_code], max_attempts=1)
+        assert self._action_batch is None, "Send Key can not be used inside an action batch"
+        self._screen_changed()
+        rc, output, errput = self._shell('input', 'keyevent', '%d' % int(key_code))
         assert rc == 0
 
     def press_back_button(self):
         '''
         Presses the back button.
         '''
-        response = self._perform_action("go_back")
+        response = self._perform_action("go_back", keyword='Press Back Button')
         assert response["success"] is True, "Could not press back button:: %s" % (response["message"])
 
     def press_menu_button(self):
         '''
         Press the menu button ("KEYCODE_MENU"), same as '| Send Key | 82 |'
         '''
+        assert self._action_batch is None, "Press Menu Button can not be used inside an action batch"
         self.send_key(82)
 
     def set_device_endpoint(self, host='localhost', port=34777):
@@ -251,12 +863,71 @@ class AndroidLibrary(object):
         `url` the base url to use for all requests
         """
 
-        parsed_url = urlparse(url)
+        self._device.set_url(url)
+        self._close_session()
+
+    def register_device(self, alias, serial=None, url='http://localhost:34777/'):
+        """
+        Register a device and make it the current one.
+
+        All further keywords act on this device until another one is
+        registered or selected with `Switch Device`.
+
+        `alias` name to refer to the device with `Switch Device`
+        `serial` adb serial of the device, as listed by "adb devices". If not given, adb uses the only connected device or $ANDROID_SERIAL.
+        `url` url of the test server on this device, every device needs its own local port
 
-        self._port = parsed_url.port
-        self._hostname = parsed_url.hostname
+        | Register Device | phone  | emulator-5554 | http://localhost:34777/ |
+        | Register Device | tablet | emulator-5556 | http://localhost:34778/ |
+        """
+        self._devices.register(Device(serial, url), alias)
 
-        self._url = url
+    def switch_device(self, alias):
+        """
+        Make a previously registered device the current one.
+
+        `alias` the alias given to `Register Device` or `Claim Device`
+        """
+        self._devices.switch(alias)
+
+    def claim_device(self, *devices):
+        """
+        Claim a device that no other test run uses and make it the current one.
+
+        Use this when several test processes share a set of devices, e.g. when
+        running suites in parallel with pabot. Every candidate is given as
+        '<serial>:<port>', the serial of the device and the local port to
+        forward its test server to. The first pair whose serial and port are
+        not claimed by another process is registered with the serial as alias.
+        Returns the serial of the claimed device.
+
+        Claims are released with `Release Device` or when the process ends.
+        All processes must use the same `device_lock_dir`, see `Importing`.
+
+        | ${serial}= | Claim Device | emulator-5554:34777 | emulator-5556:34778 |
+        | Start Emulator | ${EMULATOR_NAME} |
+        """
+        assert devices, "At least one device must be given as <serial>:<port>"
+
+        candidates = []
+        for candidate in devices:
+            serial, _, port = candidate.rpartition(':')
+            assert serial and port.isdigit(), "Device must be given as <serial>:<port>, was '%s'" % candidate
+            candidates.append((serial, int(port)))
+
+        serial, port, claim = self._device_pool.claim(candidates)
+        device = Device(serial, 'http://localhost:%d/' % port)
+        device.claim = claim
+        self._devices.register(device, serial)
+        return serial
+
+    def release_device(self):
+        """
+        Release the claim on the current device taken with `Claim Device`.
+        """
+        assert self._device.claim is not None, "The current device was not claimed with 'Claim Device'"
+        self._device.claim.release()
+        self._device.claim = None
 
     def start_testserver(self, package_name):
         '''
@@ -268,24 +939,22 @@ class AndroidLibrary(object):
         `package_name` fully qualified name of the application to test
 
         '''
-        if not self._url:
+        if not self._device.url:
             self.set_device_url()
 
-        assert self._hostname == 'localhost', (
+        assert self._device.hostname == 'localhost', (
             "Device Url was set to %s, but should be set to localhost with the "
             "'Set Device Url' keyword to use a local testserver"
         )
 
-        rc, output, errput = self._execute_with_timeout([
-            self._adb,
+        rc, output, errput = self._adb_execute(
             "wait-for-device",
             "forward",
-            "tcp:%d" % self._port,
+            "tcp:%d" % self._device.port,
             "tcp:7102"
-        ])
+        )
 
-        args = [
-            self._adb,
+        args = self._adb_command(
             "wait-for-device",
             "shell",
             "am",
@@ -294,10 +963,15 @@ class AndroidLibrary(object):
             "class",
             "sh.calaba.instrumentationbackend.InstrumentationBackend",
             "%s.test/sh.calaba.instrumentationbackend.CalabashInstrumentationTestRunner" % package_name,
-        ]
+        )
 
         logging.debug("$> %s", ' '.join(args))
-        self._testserver_proc = subprocess.Popen(args)
+        self._device.testserver_proc = subprocess.Popen(args)
+        self._device.testserver_started = time.time()
+        # without -w adb returns right after starting the instrumentation
+        self._device.testserver_waits = False
+        self._screen_changed()
+        self._device.javascript = True
 
     def start_testserver_with_apk(self, apk):
         '''
@@ -306,26 +980,24 @@ class AndroidLibrary(object):
 
         `apk` path to the apk to controll
         '''
-        if not self._url:
+        if not self._device.url:
             self.set_device_url()
 
-        assert self._hostname == 'localhost', (
+        assert self._device.hostname == 'localhost', (
             "Device Url was set to %s, but should be set to localhost with the "
             "'Set Device Url' keyword to use a local testserver"
         )
 
-        rc, output, errput = self._execute_with_timeout([
-            self._adb,
+        rc, output, errput = self._adb_execute(
             "wait-for-device",
             "forward",
-            "tcp:%d" % self._port,
+            "tcp:%d" % self._device.port,
             "tcp:7102"
-        ])
+        )
         package_name, main_activity = self._main_activity_from_apk(apk)
         if '.' not in main_activity or main_activity[0] == '.':
             main_activity = "%s.%s" % (package_name, main_activity.lstrip('.'))
-        args = [
-            self._adb,
+        args = self._adb_command(
             "shell",
             "am",
             "instrument",
@@ -343,16 +1015,28 @@ class AndroidLibrary(object):
             "class",
             "sh.calaba.instrumentationbackend.InstrumentationBackend",
             "%s.test/sh.calaba.instrumentationbackend.CalabashInstrumentationTestRunner" % package_name,
-        ]
-        self._testserver_proc = subprocess.Popen(args)
+        )
+        self._device.testserver_proc = subprocess.Popen(args)
+        self._device.testserver_started = time.time()
+        self._device.testserver_waits = True
+        self._screen_changed()
+        self._device.javascript = True
 
     def _main_activity_from_apk(self, apk):
         '''
         Returns the package_name and the Main-Action
         from a given apk
         '''
+        try:
+            return apk_main_activity(apk)
+        except AxmlError, e:
+            logging.warn("Reading the manifest of %s failed, trying calabash-android: %s" % (apk, e))
+
         rc, output, errput = self._execute_with_timeout([self._calabash_bin_path, "extract-manifest", apk])
-        xmldoc = minidom.parseString(output)
+        try:
+            xmldoc = minidom.parseString(output)
+        except ExpatError, e:
+            raise AssertionError("Could not read the manifest of %s: %s, %r" % (apk, e, errput or output))
         manifest = xmldoc.getElementsByTagName("manifest")
         assert len(manifest) > 0, "No <manifest> tag found in manifest file"
         manifest = manifest[0]
@@ -368,9 +1052,13 @@ class AndroidLibrary(object):
         Halts a previously started Android Emulator.
         '''
 
-        assert self._testserver_proc is not None, 'Tried to stop a previously started test server, but it was not started.'
+        assert self._device.testserver_proc is not None, 'Tried to stop a previously started test server, but it was not started.'
 
-        response = self._request("get", urljoin(self._url, 'kill'))
+        try:
+            response = self._request("get", urljoin(self._device.url, 'kill'))
+        finally:
+            self._close_session()
+            self._screen_changed()
 
         assert response.status_code == 200, "InstrumentationBackend sent status %d, expected 200" % response.status_code
         assert response.text == 'Affirmative!', "InstrumentationBackend replied '%s', expected 'Affirmative'" % response.text
@@ -379,35 +1067,185 @@ class AndroidLibrary(object):
         '''
         Connect to the previously started test server inside the Android
         Application. Performs a handshake.
+
+        Opens a fresh pool of keep-alive connections to the test server, which
+        is closed again by `Stop Testserver`.
         '''
 
-        response = self._request("get", urljoin(self._url, 'ping'))
+        if self._http_pool_size > 0:
+            self._open_session()
+
+        response = self._request("get", urljoin(self._device.url, 'ping'))
 
         assert response.status_code == 200, "InstrumentationBackend sent status %d, expected 200" % response.status_code
         assert response.text == 'pong', "InstrumentationBackend replied '%s', expected 'pong'" % response.text
 
-    def _perform_action(self, command, *arguments):
+    def wait_for_testserver(self, timeout=60):
+        '''
+        Waits until the test server started with `Start Testserver With Apk`
+        answers and connects to it, like `Connect To Testserver`.
+
+        The test server is pinged at growing, slightly randomized intervals.
+        Fails right away if the instrumentation exits before the test server
+        answered. Returns and logs the seconds since the test server was
+        started.
+
+        `timeout` seconds to wait at most
+
+        | Start Testserver With Apk | ${APP_APK} |
+        | Wait For Testserver | timeout=30 |
+        '''
+        timeout = float(timeout)
+        started = time.time()
+        deadline = started + timeout
+        started = self._device.testserver_started or started
+
+        if self._http_pool_size > 0:
+            self._open_session()
+
+        url = urljoin(self._device.url, 'ping')
+        interval = 0.05
+        attempts = 0
+        last_error = None
+        while True:
+            proc = self._device.testserver_proc
+            if proc is not None and self._device.testserver_waits and proc.poll() is not None:
+                raise AssertionError("Test server exited with %d before it answered" % proc.returncode)
+
+            attempts += 1
+            try:
+                response = self._request("get", url, timeout=max(min(deadline - time.time(), 5), 0.1))
+                if response.status_code == 200 and response.text == 'pong':
+                    break
+                last_error = "status %d, %r" % (response.status_code, response.text)
+            except requests.exceptions.RequestException, e:
+                last_error = str(e)
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise AssertionError("Test server did not answer within %ss after %d attempts: %s" % (
+                    timeout, attempts, last_error))
+            # jitter keeps devices started at the same time from polling in lockstep
+            time.sleep(min(random.uniform(interval / 2, interval), remaining))
+            interval = min(interval * 2, 1.0)
+
+        self._device.testserver_ready_time = time.time() - started
+        self._info("Test server ready after %.2fs, %d attempts" % (self._device.testserver_ready_time, attempts))
+        return self._device.testserver_ready_time
+
+    def _perform_action(self, command, *arguments, **kwargs):
+        # `keyword` performing the action, reported if it fails in a batch.
+        # `read_only` actions do not change the screen, by default those in
+        # READ_ONLY_COMMANDS. They are answered from the screen cache if on.
+        read_only = kwargs['read_only'] if 'read_only' in kwargs else not mutates(command)
+        if self._action_batch is not None:
+            return self._queue_action(command, arguments, kwargs.get('keyword') or command)
+        if not read_only or self._screen_cache is None:
+            return self._send_action(command, arguments, read_only)
+
+        response = self._screen_cache.get(self._device.url, command, arguments)
+        if response is None:
+            response = self._send_action(command, arguments, read_only)
+            if isinstance(response, list) or isinstance(response, dict) and response.get("success") is True:
+                self._screen_cache.put(self._device.url, command, arguments, response)
+        return response
+
+    def _screen_changed(self):
+        self._device.snapshot = None
+        if self._screen_cache is not None:
+            self._screen_cache.clear()
+
+    def _send_action(self, command, arguments, read_only=None):
+        if read_only is None:
+            read_only = not mutates(command)
+        if not read_only:
+            self._screen_changed()
         action = json.dumps({
             "command": command,
             "arguments": arguments,
         })
 
-        logging.debug(">> %r", action)
-        url = self._url
-        response = self._request("post", url, data=action,
+        sampled = self._action_log.sampled()
+        started = time.time()
+        response = self._request("post", self._device.url, data=action,
                                  headers={
                                      'Content-Type': 'application/json'
                                  },)
+        seconds = time.time() - started
 
-        logging.error("<< %r", url)
-        logging.error("<< %r", response.text)
-        assert response.status_code == 200, "InstrumentationBackend sent status %d, expected 200" % response.status_code
+        if response.status_code != 200:
+            self._action_log.failed(command, arguments, response.status_code, response.text, seconds)
+        assert response.status_code == 200, "InstrumentationBackend sent status %d, expected 200: %s" % (
+            response.status_code, Abbreviated(response.text, self._action_log.max_length))
         try:
             response_decoded = json.loads(response.text)
-            return response_decoded
         except ValueError:
-            return response.text
-        return "error"
+            response_decoded = response.text
+
+        self._timings.record('action', command, started, response.status_code, 1, len(response.text))
+        if isinstance(response_decoded, dict) and response_decoded.get("success") is False:
+            self._action_log.failed(command, arguments, response.status_code, response.text, seconds)
+        elif sampled:
+            self._action_log.succeeded(command, arguments, response.status_code, response.text, seconds)
+        return response_decoded
+
+    # commands whose result is used by the keyword, they can't be deferred
+    _UNBATCHABLE_COMMANDS = ('query', 'execute_javascript')
+
+    def _queue_action(self, command, arguments, keyword):
+        assert command not in self._UNBATCHABLE_COMMANDS, (
+            "'%s' returns data and can not be used inside an action batch" % command)
+        if mutates(command):
+            self._screen_changed()
+
+        self._action_batch.append((keyword, command, arguments))
+        return {"success": True, "message": "queued in action batch"}
+
+    def begin_action_batch(self):
+        '''
+        Starts queueing actions instead of sending them to the test server.
+
+        All keywords that perform an action on the device (`Touch Text`, `Set
+        Text`, `Scroll Down`, `Screen Should Contain`, ...) are only recorded
+        until `Execute Action Batch` sends them to the test server back to
+        back. Keywords that return data from the device, like `Webview Should
+        Contain`, and keys sent with `Send Key` or `Press Menu Button` can not
+        be used inside a batch.
+
+        A batch does not save any requests: the test server takes a single
+        action per request, so each queued action is still sent on its own.
+        Use a batch to run a sequence of actions without anything else
+        happening in between, e.g. for input that must happen before a
+        screen times out. Assertions like `Screen Should Contain` are only
+        checked by `Execute Action Batch`, which reports the keyword that
+        queued the failing one.
+
+        | Begin Action Batch   |
+        | Set Text             | 1     | Aladdin     |
+        | Set Text             | 2     | open sesame |
+        | Touch Button         | Login |             |
+        | Execute Action Batch |
+        '''
+        assert self._action_batch is None, "An action batch was already started, execute it first"
+        self._action_batch = []
+
+    def execute_action_batch(self):
+        '''
+        Sends all actions queued since `Begin Action Batch` to the test
+        server, one request per action.
+
+        Stops at the first action that failed and reports the keyword which
+        queued it, the remaining actions are discarded.
+        '''
+        assert self._action_batch is not None, "No action batch was started, use 'Begin Action Batch' first"
+
+        batch, self._action_batch = self._action_batch, None
+        for index, (keyword, command, arguments) in enumerate(batch):
+            response = self._send_action(command, arguments)
+            if not isinstance(response, dict) or response.get("success") is not True:
+                message = response.get("message") if isinstance(response, dict) else response
+                raise AssertionError("Action %d of %d in batch failed: %s %s: %s" % (
+                    index + 1, len(batch), keyword, json.dumps(arguments), message))
 
     # BEGIN: STOLEN FROM SELENIUM2LIBRARY
 
@@ -419,8 +1257,8 @@ class AndroidLibrary(object):
 
     def _get_screenshot_paths(self, filename):
         if not filename:
-            self._screenshot_index += 1
-            filename = 'android-screenshot-%d.png' % self._screenshot_index
+            filename = 'android-screenshot-%d.%s' % (next(self._screenshot_counter),
+                                                     self._screenshot_options.extension)
         else:
             filename = filename.replace('/', os.sep)
         logdir = self._get_log_dir()
@@ -452,28 +1290,325 @@ class AndroidLibrary(object):
         `relative_url` URL part, relative to the device endpoint. For the standard setup the default value is sufficient.
         '''
 
-        path, link = self._get_screenshot_paths(filename)
-        response = self._request("get", urljoin(self._url, relative_url))
+        options = self._screenshot_options
+        response = self._request("get", urljoin(self._device.url, relative_url), stream=True)
+        try:
+            if response.status_code == 500:
+                raise AssertionError("Unable to make a screenshot, see documentation on how to handle this")
+
+            assert response.status_code == 200, "InstrumentationBackend sent status %d, expected 200" % response.status_code
+
+            if options.deduplicate and not filename:
+                link = self._store_screenshot(response.raw.read(decode_content=True), options)
+                if link is None:
+                    return
+            else:
+                path, link = self._get_screenshot_paths(filename)
+                if self._screenshot_writer is not None:
+                    self._screenshot_writer.put(options, response.raw.read(decode_content=True), path)
+                elif options.reencode:
+                    options.save(response.raw.read(decode_content=True), path)
+                else:
+                    with open(path, 'wb') as f:
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            f.write(chunk)
+        finally:
+            response.close()
 
-        if response.status_code == 500:
-            raise AssertionError("Unable to make a screenshot, see documentation on how to handle this")
+        self._info('</td></tr><tr><td colspan="3"><a href="%s">'
+                    '<img src="%s"></a>' % (link, link), True)
 
-        assert response.status_code == 200, "InstrumentationBackend sent status %d, expected 200" % response.status_code
+    def _store_screenshot(self, content, options):
+        '''
+        Stores the screenshot in a file named after its content, unless the
+        same screenshot was stored before. Returns the link to the file, or
+        None if the screen did not change since the last screenshot.
+        '''
+        if options.skip_unchanged is not None:
+            signature = screen_signature(content)
+            last = self._device.last_screenshot
+            if last is not None and same_screen(signature, last[0], options.skip_unchanged):
+                self._info('Screen unchanged since <a href="%s">last screenshot</a>' % last[1], True)
+                return None
+
+        logdir = self._get_log_dir()
+        path = os.path.join(logdir, options.filename(content))
+        link = robot.utils.get_link_path(path, logdir)
+        if not os.path.exists(path):
+            if self._screenshot_writer is not None:
+                self._screenshot_writer.put(options, content, path)
+            else:
+                options.save(content, path)
+
+        if options.skip_unchanged is not None:
+            self._device.last_screenshot = (signature, link)
+        return link
+
+    def set_screenshot_options(self, format='png', quality=None, max_width=None, background=False,
+                               deduplicate=False, skip_unchanged=None):
+        '''
+        Sets how `Capture Screenshot` stores screenshots.
+
+        `format` png (as sent by the device), jpeg or webp
+        `quality` image quality for jpeg and webp from 1 to 100
+        `max_width` scale screenshots wider than this many pixels down
+        `background` if true, screenshots are written to disk in a background thread, use `Wait For Screenshots` to wait for them
+        `deduplicate` if true, screenshots are stored in files named after their content, identical screenshots are stored only once
+        `skip_unchanged` with `deduplicate`, do not store or embed a screenshot if it looks like the previous one of the device. The number is how many of the 64 bits of the perceptual hashes of the two screenshots may differ, 0 for screens looking exactly the same
+
+        Screenshots given a filename are always stored under that name.
+
+        Converting, scaling and comparing screenshots needs the Python
+        Imaging Library (PIL or Pillow).
+
+        | Set Screenshot Options | format=jpeg | quality=70 | max_width=480 | background=True |
+        | Set Screenshot Options | deduplicate=True | skip_unchanged=2 |
+        '''
+        self._screenshot_options = ScreenshotOptions(format, quality, max_width, _is_true(deduplicate),
+                                                     skip_unchanged)
+        if _is_true(background):
+            if self._screenshot_writer is None:
+                self._screenshot_writer = ScreenshotWriter()
+        elif self._screenshot_writer is not None:
+            self.wait_for_screenshots()
+            self._screenshot_writer = None
+
+    def wait_for_screenshots(self):
+        '''
+        Waits until all screenshots taken with `background` enabled (see `Set
+        Screenshot Options`) are written to disk. Fails if any of them could
+        not be saved.
+        '''
+        if self._screenshot_writer is not None:
+            self._screenshot_writer.flush()
+
+    def start_screen_recording(self, bit_rate=None, size=None):
+        '''
+        Starts recording the screen of the device in the background, with
+        `adb shell screenrecord` (Android 4.4 and later). Use `Stop Screen
+        Recording` to get the video.
+
+        Recordings longer than three minutes are split into several videos
+        by screenrecord.
+
+        `bit_rate` of the video in bits per second, screenrecord defaults to 4000000
+        `size` of the video as WIDTHxHEIGHT, e.g. 360x640, defaults to the screen size
+
+        | Start Screen Recording | size=360x640 |
+        '''
+        assert self._device.recorder is None, "The screen is already being recorded"
+        recorder = ScreenRecorder(self._adb_command(), self._shell_runner(), bit_rate, size)
+        recorder.start()
+        self._device.recorder = recorder
+
+    def stop_screen_recording(self, filename=None, last=None):
+        '''
+        Stops recording the screen, copies the video to the log directory
+        and embeds it in the log. Returns the paths of the video files.
+
+        Trimming the video and joining videos of recordings longer than three
+        minutes needs ffmpeg on the $PATH, without it only whole videos are
+        left out.
+
+        `filename` of the video (optional)
+        `last` keep only the last seconds of the recording (optional)
+
+        | [Teardown] | Run Keyword If Test Failed | Stop Screen Recording | last=30 |
+        '''
+        recorder = self._device.recorder
+        assert recorder is not None, "The screen is not being recorded, use 'Start Screen Recording' first"
+        self._device.recorder = None
+        stopped = recorder.stop()
+
+        segments = []
+        ends = [started for remote_path, started in recorder.segments[1:]] + [stopped]
+        cut = stopped - float(last) if last else 0
+        for (remote_path, started), end in zip(recorder.segments, ends):
+            if end > cut:
+                segments.append((remote_path, max(cut - started, 0)))
+
+        if not filename:
+            filename = 'android-recording-%d.mp4' % next(self._recording_counter)
+        base, extension = os.path.splitext(os.path.join(self._get_log_dir(), filename.replace('/', os.sep)))
+        if not os.path.isdir(os.path.dirname(base)):
+            os.makedirs(os.path.dirname(base))
+
+        paths = []
+        try:
+            for index, (remote_path, offset) in enumerate(segments):
+                path = '%s-%d%s' % (base, index + 1, extension) if len(segments) > 1 else base + extension
+                rc, output, errput = self._adb_execute('pull', remote_path, path, max_attempts=1, max_timeout=300)
+                assert rc == 0, "Pulling screen recording failed: %d, %r" % (rc, errput or output)
+                paths.append(path)
+        finally:
+            self._shell('rm', '-f', *[remote_path for remote_path, started in recorder.segments])
+
+        assert paths, "Screen recording failed: %s" % (recorder.error or "no video was recorded")
+
+        offset = segments[0][1]
+        if offset > 0 or len(paths) > 1:
+            paths = self._join_videos(paths, offset, base + extension)
+
+        for path in paths:
+            link = robot.utils.get_link_path(path, self._get_log_dir())
+            self._info('</td></tr><tr><td colspan="3"><video src="%s" controls width="360">'
+                        '<a href="%s">%s</a></video>' % (link, link, os.path.basename(path)), True)
+        return paths
+
+    def _join_videos(self, paths, offset, path):
+        '''
+        Joins the videos and cuts `offset` seconds from the start, with
+        ffmpeg. Returns the paths of the resulting videos, the given ones if
+        ffmpeg is not available.
+        '''
+        try:
+            ffmpeg = self._env_command(['ffmpeg', 'ffmpeg.exe'])
+        except AssertionError:
+            logging.warn("ffmpeg not found, screen recordings are neither trimmed nor joined")
+            return paths
+
+        playlist = path + '.txt'
+        with open(playlist, 'w') as f:
+            for video in paths:
+                f.write("file '%s'\n" % os.path.abspath(video).replace("'", "'\\''"))
+        output = '%s.joined%s' % os.path.splitext(path)
+        rc, out, errput = self._execute_with_timeout(
+            [ffmpeg, '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', playlist,
+             '-ss', '%.3f' % offset, '-c', 'copy', output], max_attempts=1, max_timeout=300)
+        os.remove(playlist)
+        if rc != 0:
+            logging.warn("Joining screen recordings failed: %s" % errput)
+            return paths
+
+        for video in paths:
+            os.remove(video)
+        os.rename(output, path)
+        return [path]
+
+    def start_logcat_capture(self, tags=None, priority='V', max_lines=10000, filename=None, clear=False):
+        '''
+        Starts collecting the log of the device with `adb logcat` in the
+        background. The last `max_lines` lines are kept in memory, see `Log
+        Logcat`.
+
+        `tags` comma separated tags to collect, defaults to all
+        `priority` lowest priority to collect: V, D, I, W, E or F
+        `max_lines` number of lines kept in memory
+        `filename` of a file in the log directory to which the whole log is written, gzip compressed if it ends with .gz (optional)
+        `clear` if true, the log of the device is cleared first
+
+        | Start Logcat Capture | tags=ActivityManager,MyApp | priority=I | filename=logcat.txt.gz |
+        '''
+        assert self._device.logcat is None, "Logcat is already being captured"
+        if _is_true(clear):
+            rc, output, errput = self._adb_execute('logcat', '-c')
+            assert rc == 0, "Clearing logcat failed: %d, %r" % (rc, errput or output)
+        path = None
+        if filename:
+            path = os.path.join(self._get_log_dir(), filename.replace('/', os.sep))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+        collector = LogcatCollector(self._adb_command(), _as_list(tags), priority, int(max_lines), path)
+        collector.start()
+        self._device.logcat = collector
+
+    def stop_logcat_capture(self):
+        '''
+        Stops collecting the log of the device. Returns the path of the file
+        the log was written to, if a `filename` was given to `Start Logcat
+        Capture`.
+        '''
+        collector = self._device.logcat
+        assert collector is not None, "Logcat is not being captured, use 'Start Logcat Capture' first"
+        self._device.logcat = None
+        collector.stop()
+        if collector.path:
+            link = robot.utils.get_link_path(collector.path, self._get_log_dir())
+            self._info('Logcat written to <a href="%s">%s</a>' % (link, os.path.basename(collector.path)), True)
+        return collector.path
+
+    def log_logcat(self, since='test'):
+        '''
+        Logs the lines of the device log collected by `Start Logcat Capture`
+        and returns them.
+
+        `since` test for the lines since the current test started, all for all lines kept in memory. Only all works outside of tests, e.g. in suite setups and teardowns
+
+        | [Teardown] | Run Keyword If Test Failed | Log Logcat |
+        '''
+        collector = self._device.logcat
+        assert collector is not None, "Logcat is not being captured, use 'Start Logcat Capture' first"
+        assert since in ('test', 'all'), "Since must be test or all, but was '%s'" % since
+        started = None
+        if since == 'test':
+            started = self.ROBOT_LIBRARY_LISTENER.test_started
+            assert started is not None, "The start of the current test is unknown, use since=all outside of tests"
+        lines = collector.lines(started)
+        if collector.truncated(started):
+            self._info("Only the last %d lines of logcat were kept" % collector.max_lines)
+        text = ''.join(lines).decode('utf-8', 'replace')
+        self._info(text)
+        return text
+
+    def set_action_logging(self, max_length=1000, sample_rate=1):
+        '''
+        Sets how the actions sent to the test server are logged at debug
+        level. Failed actions are always logged completely, at info level.
+
+        `max_length` number of characters of each action and response to log, 0 for all
+        `sample_rate` share of successful actions to log, between 0 (none) and 1 (all)
+
+        | Set Action Logging | max_length=200 | sample_rate=0.1 |
+        '''
+        self._action_log.max_length = int(max_length)
+        self._action_log.sample_rate = float(sample_rate)
+
+    def _timing_report_path(self):
+        if not self._timing_report:
+            return None
+        return os.path.join(GLOBAL_VARIABLES['${OUTPUTDIR}'], self._timing_report)
 
-        with open(path, 'w') as f:
-            f.write(response.content)
-            f.close()
+    def log_timings(self):
+        '''
+        Logs a table with how often and how long keywords, adb commands,
+        shell commands, HTTP requests and actions of the test server were
+        run so far, the most time consuming first.
+
+        | [Teardown] | Log Timings |
+        '''
+        self._info(self._timings.html_table(), True)
 
-        logger.info('</td></tr><tr><td colspan="3"><a href="%s">'
-                    '<img src="%s"></a>' % (link, link), True, False)
+    def export_timings(self, path, format='json'):
+        '''
+        Writes the timings of all calls so far to a file.
+
+        `path` of the file to write
+        `format` json (summary and every call), csv (summary) or prometheus (summary in the Prometheus text format)
+
+        | Export Timings | ${OUTPUT DIR}/timings.prom | format=prometheus |
+        '''
+        writers = {
+            'json': self._timings.write_json,
+            'csv': self._timings.write_csv,
+            'prometheus': self._timings.write_prometheus,
+        }
+        assert format in writers, "Format must be one of %s, but was '%s'" % (', '.join(sorted(writers)), format)
+        writers[format](path)
 
     def screen_should_contain(self, text):
         '''
         Asserts that the current screen contains a given text
 
         `text` String that should be on the current screen
+
+        After `Get Screen Snapshot`, the text is looked up in the snapshot
+        without asking the test server.
         '''
-        response = self._perform_action("assert_text", text, True)
+        snapshot = self._current_snapshot()
+        if snapshot is not None:
+            assert snapshot.contains_text(text), "Screen snapshot does not contain text '%s'" % text
+            return
+        response = self._perform_action("assert_text", text, True, keyword='Screen Should Contain')
         assert response["success"] is True, "Screen does not contain text '%s': %s" % (text, response["message"])
 
     def screen_should_not_contain(self, text):
@@ -481,17 +1616,187 @@ class AndroidLibrary(object):
         Asserts that the current screen does not contain a given text
 
         `text` String that should not be on the current screen
+
+        After `Get Screen Snapshot`, the text is looked up in the snapshot
+        without asking the test server.
         '''
-        response = self._perform_action("assert_text", text, False)
+        snapshot = self._current_snapshot()
+        if snapshot is not None:
+            assert not snapshot.contains_text(text), "Screen snapshot does contain text '%s', but shouldn't have" % text
+            return
+        response = self._perform_action("assert_text", text, False, keyword='Screen Should Not Contain')
         assert response["success"] is True, "Screen does contain text '%s', but shouldn't have: %s" % (text, response["message"])
 
+    def _current_snapshot(self):
+        # keywords inside an action batch are queued in order, they must not
+        # be answered before the actions queued earlier ran
+        if self._action_batch is not None:
+            return None
+        return self._device.snapshot
+
+    def get_screen_snapshot(self, relative_url='dump'):
+        '''
+        Fetches the view hierarchy of the current screen once, to answer
+        following assertions locally. Returns the number of visible views.
+
+        `Screen Should Contain`, `Screen Should Not Contain` and `Screen
+        Should Contain View` use the snapshot instead of asking the test
+        server, until a keyword changes the screen: touching, typing,
+        scrolling, swiping, pressing keys or waiting for the screen to
+        change. Changes the app makes by itself are not noticed, take a new
+        snapshot after them.
+
+        `relative_url` URL part of the view hierarchy dump, relative to the device endpoint. For the standard setup the default value is sufficient.
+
+        | Get Screen Snapshot |
+        | Screen Should Contain | Username |
+        | Screen Should Contain | Password |
+        | Screen Should Contain View | id=login_button |
+        '''
+        assert self._action_batch is None, "Get Screen Snapshot can not be used inside an action batch"
+        response = self._request("get", urljoin(self._device.url, relative_url))
+        assert response.status_code == 200, "InstrumentationBackend sent status %d, expected 200" % response.status_code
+        try:
+            snapshot = ViewSnapshot(json.loads(response.text))
+        except ValueError:
+            raise AssertionError("InstrumentationBackend sent no view hierarchy: %s" % (
+                Abbreviated(response.text, self._action_log.max_length)))
+        self._device.snapshot = snapshot
+        return len(snapshot.views)
+
+    def screen_should_contain_view(self, locator):
+        '''
+        Asserts that the current screen contains a view, looked up in the
+        snapshot of `Get Screen Snapshot`. A snapshot is taken if there is
+        none.
+
+        `locator` which view to find. Valid locators are 'text=<string>', 'id=<string>', 'class=<string>' or 'desc=<string>' for the content description, a locator without strategy is a text
+
+        | Screen Should Contain View | class=android.widget.ProgressBar |
+        '''
+        strategy, query = self._split_locator(locator, "text")
+        if self._current_snapshot() is None:
+            self.get_screen_snapshot()
+        assert self._device.snapshot.find(strategy, query), "Screen does not contain view '%s'" % locator
+
+    def set_screen_cache(self, enabled=True, ttl=5):
+        '''
+        Turns the screen cache on or off.
+
+        With the cache on, `Screen Should Contain`, `Screen Should Not
+        Contain`, the webview assertions and other keywords that only read
+        the screen are answered from memory when they are repeated with the
+        same arguments. The cache is emptied whenever a keyword changes the
+        screen, like touching, typing, scrolling, swiping, pressing keys or
+        waiting for the screen to change, and by `Invalidate Screen Cache`.
+        Only successful results are cached, failed assertions are always
+        checked again.
+
+        Changes the app makes by itself are only noticed after `ttl`
+        seconds, or after `Invalidate Screen Cache`.
+
+        `enabled` whether to cache results
+        `ttl` seconds a result is kept at most, 0 for no limit
+
+        | Set Screen Cache | ttl=2 |
+        '''
+        ttl = float(ttl) or None
+        if not _is_true(enabled):
+            self._screen_cache = None
+        elif self._screen_cache is None:
+            self._screen_cache = ScreenCache(ttl)
+        else:
+            self._screen_cache.ttl = ttl
+            self._screen_cache.clear()
+
+    def invalidate_screen_cache(self):
+        '''
+        Forgets the cached results of `Set Screen Cache` and the snapshot of
+        `Get Screen Snapshot`, for when the app changed the screen by itself.
+
+        | Screen Should Not Contain | Download complete |
+        | Sleep                     | 5 seconds         |
+        | Invalidate Screen Cache   |
+        | Screen Should Contain     | Download complete |
+        '''
+        self._screen_changed()
+
+    def get_screen_cache_statistics(self):
+        '''
+        Returns and logs how many results were answered from the screen
+        cache (hits) and how many had to be asked from the test server
+        (misses), as a dictionary with the keys hits, misses and entries.
+        '''
+        assert self._screen_cache is not None, "The screen cache is off, use 'Set Screen Cache' first"
+        statistics = self._screen_cache.statistics()
+        self._info("Screen cache: %(hits)d hits, %(misses)d misses, %(entries)d entries" % statistics)
+        return statistics
+
+    def wait_until_screen_contains(self, text, timeout=10):
+        '''
+        Waits until the current screen contains a given text
+
+        The test server waits for the text itself, so only one request is
+        sent. Test servers that can not wait are polled with `Screen Should
+        Contain` instead.
+
+        `text` String that should appear on the current screen
+        `timeout` seconds to wait at most
+
+        | Touch Button | Login |
+        | Wait Until Screen Contains | Welcome | timeout=30 |
+        '''
+        timeout = float(timeout)
+        deadline = time.time() + timeout
+        response = self._perform_action("wait_for_text", text, '%d' % max(math.ceil(timeout), 1), keyword='Wait Until Screen Contains')
+        if response["success"] is True:
+            return
+
+        # the test server answered early, it does not know the command
+        if time.time() < deadline - 1:
+            logging.debug("wait_for_text failed early, polling instead: %s", response["message"])
+            response = self._poll_action(deadline, "assert_text", text, True)
+        assert response["success"] is True, "Screen did not contain text '%s' within %ss: %s" % (
+            text, timeout, response["message"])
+
+    def wait_until_screen_does_not_contain(self, text, timeout=10):
+        '''
+        Waits until the current screen does not contain a given text anymore
+
+        `text` String that should disappear from the current screen
+        `timeout` seconds to wait at most
+
+        | Touch Button | Save |
+        | Wait Until Screen Does Not Contain | Saving... | timeout=30 |
+        '''
+        assert self._action_batch is None, "Wait Until Screen Does Not Contain can not be used inside an action batch"
+        self._screen_changed()
+        timeout = float(timeout)
+        response = self._poll_action(time.time() + timeout, "assert_text", text, False)
+        assert response["success"] is True, "Screen still contained text '%s' after %ss: %s" % (
+            text, timeout, response["message"])
+
+    def _poll_action(self, deadline, command, *arguments):
+        '''
+        Performs the action at growing intervals until it succeeds or the
+        deadline passed, returns the last response.
+        '''
+        interval = 0.1
+        while True:
+            response = self._send_action(command, arguments)
+            remaining = deadline - time.time()
+            if response["success"] is True or remaining <= 0:
+                return response
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, 1.0)
+
     def touch_button(self, text):
         '''
         Touch an android.widget.Button
 
         `text` is the text the button that will be clicked contains
         '''
-        response = self._perform_action("press_button_with_text", text)
+        response = self._perform_action("press_button_with_text", text, keyword='Touch Button')
         assert response["success"] is True, "Touching button '%s' failed: %s" % (text, response["message"])
 
     def touch_text(self, text):
@@ -500,14 +1805,14 @@ class AndroidLibrary(object):
 
         `text` is the text the button that will be clicked contains
         '''
-        response = self._perform_action("click_on_text", text)
+        response = self._perform_action("click_on_text", text, keyword='Touch Text')
         assert response["success"] is True, "Touching text '%s' failed: %s" % (text, response["message"])
 
     def scroll_up(self):
         '''
         Scroll up
         '''
-        response = self._perform_action("scroll_up")
+        response = self._perform_action("scroll_up", keyword='Scroll Up')
         assert response["success"] is True, "Scrolling up failed: %s" % (response["message"])
 
     def touch_position(self, percent_left, percent_top):
@@ -519,14 +1824,14 @@ class AndroidLibrary(object):
         '''
         percent_left = int(percent_left)
         percent_top = int(percent_top)
-        response = self._perform_action("click_on_screen", percent_left, percent_top)
+        response = self._perform_action("click_on_screen", percent_left, percent_top, keyword='Touch Position')
         assert response["success"] is True, "Touching position %s, %s failed: %s" % (percent_left, percent_top, response["message"])
 
     def scroll_down(self):
         '''
         Scroll down
         '''
-        response = self._perform_action("scroll_down")
+        response = self._perform_action("scroll_down", keyword='Scroll Down')
         assert response["success"] is True, "Scrolling down failed: %s" % (response["message"])
 
     def _split_locator(self, locator, default_strategy="css"):
@@ -546,7 +1851,7 @@ class AndroidLibrary(object):
         `value` the new value
         '''
         strategy, query = self._split_locator(locator)
-        response = self._perform_action("set_text", strategy, query, value)
+        response = self._perform_action("set_text", strategy, query, value, keyword='Set Webview Text')
         assert response["success"] is True, "Setting webview text failed: %s" % (response["message"])
 
     def touch_webview_element(self, locator):
@@ -556,7 +1861,7 @@ class AndroidLibrary(object):
         `locator` locator for element to trigger a click event (only css locators are supported at the moment)
         '''
         strategy, query = self._split_locator(locator)
-        response = self._perform_action("touch", strategy, query)
+        response = self._perform_action("touch", strategy, query, keyword='Touch Webview Element')
         assert response["success"] is True, "Touching Webview element '%s' failed: %s" % (locator, response["message"])
 
     def webview_scroll_to(self, locator):
@@ -565,7 +1870,7 @@ class AndroidLibrary(object):
         `locator` locator for element to scroll to (only css locators are supported at the moment)
         '''
         strategy, query = self._split_locator(locator)
-        response = self._perform_action("scroll_to", strategy, query)
+        response = self._perform_action("scroll_to", strategy, query, keyword='Webview Scroll To')
         assert response["success"] is True, "Scrolling to Webview element '%s' failed: %s" % (locator, response["message"])
 
     def set_text(self, locator, value):
@@ -596,30 +1901,110 @@ class AndroidLibrary(object):
             '", "'.join(api_names.keys()), strategy
         )
 
-        response = self._perform_action(api_names[strategy], value, query)
+        response = self._perform_action(api_names[strategy], value, query, keyword='Set Text')
         assert response["success"] is True, "Setting the text '%s' failed: %s" % (locator, response["message"])
 
     def webview_should_contain(self, text):
         '''
         assert that the webview contains a given text
 
+        The text is searched in the webview, only the result is sent back.
+
         `text` the text the webview should contain
         '''
-        response = self._perform_action("query", "css", "html")
-        assert text in response[0]["textContent"], "Webview does not contain '%s': %s" % (text, response["message"])
+        found = self._execute_javascript(webview.contains_script(text))
+        if found is None:
+            found = text in self._query_webview("css", "html")[0]["textContent"]
+        assert found, "Webview does not contain '%s'" % text
+
+    def webview_should_contain_element(self, locator, text=None):
+        '''
+        Asserts that the webview contains an element, optionally one with a
+        given text
+
+        `locator` locator for the element, css=<selector> or xpath=<expression>
+        `text` the text the element should contain (optional)
+
+        | Webview Should Contain Element | css=#cart .item | text=Apples |
+        '''
+        assert self.get_webview_element_count(locator, text) > 0, "Webview does not contain element '%s'%s" % (
+            locator, " with text '%s'" % text if text is not None else "")
+
+    def get_webview_element_count(self, locator, text=None):
+        '''
+        Returns the number of elements in the webview matching the locator,
+        counted in the webview
+
+        `locator` locator for the elements, css=<selector> or xpath=<expression>
+        `text` only count elements containing this text (optional)
+
+        | ${items}= | Get Webview Element Count | css=#cart .item |
+        '''
+        strategy, query = self._split_locator(locator)
+        count = self._execute_javascript(webview.count_script(strategy, query, text))
+        if count is not None:
+            return count
+        elements = self._query_webview(strategy, query)
+        return len([element for element in elements if text is None or text in element.get("textContent", "")])
+
+    def query_webview(self, locator, *fields):
+        '''
+        Returns the elements in the webview matching the locator, as a list
+        of dictionaries with only the given fields
+
+        `locator` locator for the elements, css=<selector> or xpath=<expression>
+        `fields` attributes or properties of the elements to return, like textContent, href or value
+
+        | ${links}= | Query Webview | css=a | href | textContent |
+        '''
+        assert fields, "Query Webview needs at least one field"
+        strategy, query = self._split_locator(locator)
+        elements = self._execute_javascript(webview.projection_script(strategy, query, fields))
+        if elements is not None:
+            return elements
+        return [dict((field, element.get(field)) for field in fields)
+                for element in self._query_webview(strategy, query)]
+
+    def _execute_javascript(self, script):
+        '''
+        Evaluates a `script` of the webview module in the webview and
+        returns its result, None if the test server does not know the
+        execute_javascript action. The whole elements are queried instead
+        then, until the test server is restarted.
+        '''
+        if not self._device.javascript:
+            return None
+        response = self._perform_action("execute_javascript", script, read_only=True)
+        message = response.get("message") if isinstance(response, dict) else response
+        if not isinstance(response, dict) or response.get("success") is not True:
+            # test servers name the action they do not know in the message,
+            # other failures like a webview that is not loaded yet are reported
+            if "execute_javascript" not in unicode(message):
+                raise AssertionError("Executing JavaScript in the webview failed: %s" % message)
+            logging.info("The test server can not execute JavaScript, querying the whole elements instead: %s",
+                         Abbreviated(message, self._action_log.max_length))
+            self._device.javascript = False
+            return None
+        return webview.result(message)
+
+    def _query_webview(self, strategy, query):
+        response = self._perform_action("query", strategy, query)
+        assert isinstance(response, list), "Querying webview for '%s=%s' failed: %s" % (
+            strategy, query, response.get("message") if isinstance(response, dict) else response)
+        return response
 
     def swipe_left(self):
         '''
         Performs a swipe gesture to the left
         '''
-        response = self._perform_action('swipe', 'left')
+        response = self._perform_action('swipe', 'left', keyword='Swipe Left')
         assert response["success"] is True, "Swiping left failed: %s" % response["message"]
 
     def swipe_right(self):
         '''
         Performs a swipe gesture to the right
         '''
-        response = self._perform_action('swipe', 'right')
+        response = self._perform_action('swipe', 'right', keyword='Swipe Right')
         assert response["success"] is True, "Swiping right failed: %s" % response["message"]
 
     def touch_view(self, locator):
@@ -629,7 +2014,7 @@ class AndroidLibrary(object):
         `locator` which view will be touched. Valid locators are '<string>' or'desc=<string>' for an imageButton with a contentDescription set.
         '''
         strategy, query = self._split_locator(locator, "desc")
-        response = self._perform_action('click_on_view_by_description', query)
+        response = self._perform_action('click_on_view_by_description', query, keyword='Touch View')
         assert response["success"] is True, "Click on view failed: %s" % response["message"]
 
     def touch_image_button(self, locator):
@@ -651,5 +2036,31 @@ class AndroidLibrary(object):
         elif strategy == "desc":
             action = "press_image_button_description"
 
-        response = self._perform_action(action, query)
+        response = self._perform_action(action, query, keyword='Touch Image Button')
         assert response["success"] is True, "Touching image '%s' failed: %s" % (locator,response["message"])
+
+
+class ActionBatch(object):
+    '''
+    Context manager to batch actions from Python code
+
+    Actions performed inside the `with` block are queued and sent to the test
+    server when the block is left, if the block raises they are discarded.
+
+        with ActionBatch(library):
+            library.set_text('1', 'Aladdin')
+            library.touch_button('Login')
+    '''
+
+    def __init__(self, library):
+        self._library = library
+
+    def __enter__(self):
+        self._library.begin_action_batch()
+        return self._library
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self._library._action_batch = None
+            return False
+        self._library.execute_action_batch()
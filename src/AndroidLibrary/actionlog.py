@@ -0,0 +1,64 @@
+import json
+import logging
+import random
+
+
+class Abbreviated(object):
+    '''
+    Formats `value` for a log message only when the message is actually
+    emitted, cut to `limit` characters. Values that are no strings are
+    formatted as JSON.
+    '''
+
+    def __init__(self, value, limit=None):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = self.value
+        if not isinstance(text, basestring):
+            text = json.dumps(text)
+        if self.limit and len(text) > self.limit:
+            text = u'%s... (%d characters)' % (text[:self.limit], len(text))
+        if isinstance(text, unicode):
+            return text.encode('utf-8')
+        return text
+
+
+class ActionLog(object):
+    '''
+    Logs the actions sent to the test server and their responses.
+
+    Successful actions are logged at debug level, only a `sample_rate`
+    share of them and with payloads cut to `max_length` characters. Failed
+    actions are always logged in full, at info level. Every record carries the command,
+    the HTTP status and the duration as `action`, `status` and
+    `elapsed_ms` attributes for structured log handlers.
+    '''
+
+    def __init__(self, max_length=1000, sample_rate=1.0, logger=None):
+        self.max_length = max_length
+        self.sample_rate = sample_rate
+        self._logger = logger or logging.getLogger()
+
+    def sampled(self):
+        '''
+        Whether the next successful action is logged. Decided before the
+        action is sent, so nothing is prepared for actions that are not.
+        '''
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def _log(self, level, command, arguments, status, text, seconds, limit):
+        self._logger.log(level, "action %s %s -> %s in %.1fms: %s", command, Abbreviated(arguments, limit),
+                         status, seconds * 1000, Abbreviated(text, limit),
+                         extra={'action': command, 'status': status, 'elapsed_ms': seconds * 1000})
+
+    def succeeded(self, command, arguments, status, text, seconds):
+        self._log(logging.DEBUG, command, arguments, status, text, seconds, self.max_length)
+
+    def failed(self, command, arguments, status, text, seconds):
+        # not a warning, failures are often expected (polling, Run Keyword
+        # And Return Status) and the keyword fails with its own message
+        self._log(logging.INFO, command, arguments, status, text, seconds, None)
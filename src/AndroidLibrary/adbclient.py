@@ -0,0 +1,262 @@
+'''
+Client for the host protocol of the adb server
+
+Talks to the adb server (usually localhost:5037) over TCP instead of
+starting the adb executable, see SERVICES.TXT and SYNC.TXT in the adb
+sources for the protocol.
+'''
+
+import os
+import socket
+import stat
+import struct
+import time
+import uuid
+
+from adbshell import AdbShellError
+
+
+class AdbClientError(Exception):
+    '''
+    The adb server refused a request or the connection to it failed.
+    '''
+
+
+class AdbClient(object):
+
+    SYNC_DATA_MAX = 64 * 1024
+
+    def __init__(self, host='localhost', port=5037, timeout=120):
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+
+    # connection and framing
+
+    def _connect(self, timeout=None):
+        try:
+            return socket.create_connection((self.host, self.port), timeout or self.timeout)
+        except socket.error, e:
+            raise AdbClientError("Could not connect to adb server at %s:%d: %s" % (self.host, self.port, e))
+
+    def _read_exactly(self, sock, length):
+        chunks = []
+        while length > 0:
+            chunk = sock.recv(min(length, 65536))
+            if not chunk:
+                raise AdbClientError("adb server closed the connection")
+            chunks.append(chunk)
+            length -= len(chunk)
+        return ''.join(chunks)
+
+    def _send_request(self, sock, request):
+        sock.sendall('%04x%s' % (len(request), request))
+        self._read_status(sock, request)
+
+    def _read_status(self, sock, request):
+        status = self._read_exactly(sock, 4)
+        if status == 'OKAY':
+            return
+        if status == 'FAIL':
+            length = int(self._read_exactly(sock, 4), 16)
+            raise AdbClientError("'%s' failed: %s" % (request, self._read_exactly(sock, length)))
+        raise AdbClientError("'%s': unexpected reply %r" % (request, status))
+
+    def _read_all(self, sock):
+        chunks = []
+        for chunk in iter(lambda: sock.recv(65536), ''):
+            chunks.append(chunk)
+        return ''.join(chunks)
+
+    def _transport(self, serial, timeout=None):
+        '''
+        Returns a socket connected to the device with the given serial, or the
+        only device if serial is None.
+        '''
+        sock = self._connect(timeout)
+        try:
+            if serial is None:
+                self._send_request(sock, 'host:transport-any')
+            else:
+                self._send_request(sock, 'host:transport:%s' % serial)
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def _host_prefix(self, serial):
+        if serial is None:
+            return 'host:'
+        return 'host-serial:%s:' % serial
+
+    # services
+
+    def devices(self):
+        '''
+        Returns a list of (serial, state) tuples of all devices
+        '''
+        sock = self._connect()
+        try:
+            self._send_request(sock, 'host:devices')
+            length = int(self._read_exactly(sock, 4), 16)
+            output = self._read_exactly(sock, length)
+        finally:
+            sock.close()
+        return [tuple(line.split('\t', 1)) for line in output.splitlines() if '\t' in line]
+
+    def wait_for_device(self, serial, timeout=None):
+        deadline = time.time() + (timeout or self.timeout)
+        interval = 0.1
+        while True:
+            try:
+                self._transport(serial, timeout).close()
+                return
+            except (AdbClientError, socket.error):
+                if time.time() + interval > deadline:
+                    raise
+            time.sleep(interval)
+            interval = min(interval * 2, 2.0)
+
+    def shell(self, serial, command, timeout=None):
+        '''
+        Runs a shell command on the device, returns its exit code and output.
+        '''
+        sentinel = uuid.uuid4().hex
+        sock = self._transport(serial, timeout)
+        try:
+            self._send_request(sock, 'shell:%s; echo "%s" $?' % (command, sentinel))
+            output = self._read_all(sock).replace('\r\n', '\n')
+        except socket.timeout:
+            raise AdbClientError("'%s' did not finish within %ss" % (command, timeout or self.timeout))
+        finally:
+            sock.close()
+
+        output, found, rc = output.rpartition(sentinel)
+        if not found:
+            raise AdbClientError("'%s' was cut off: %r" % (command, rc))
+        return int(rc.strip() or -1), output
+
+    def forward(self, serial, local, remote):
+        sock = self._connect()
+        try:
+            request = '%sforward:%s;%s' % (self._host_prefix(serial), local, remote)
+            self._send_request(sock, request)
+            # newer servers confirm once more after the forward was set up,
+            # older ones just close the connection
+            sock.settimeout(1)
+            try:
+                status = sock.recv(4)
+            except socket.timeout:
+                status = ''
+            if status == 'FAIL':
+                length = int(self._read_exactly(sock, 4), 16)
+                raise AdbClientError("'%s' failed: %s" % (request, self._read_exactly(sock, length)))
+        finally:
+            sock.close()
+
+    def push(self, serial, local_path, remote_path, mode=0644):
+        sock = self._transport(serial)
+        try:
+            self._send_request(sock, 'sync:')
+            header = '%s,%d' % (remote_path, stat.S_IFREG | mode)
+            sock.sendall('SEND' + struct.pack('<I', len(header)) + header)
+            with open(local_path, 'rb') as f:
+                for data in iter(lambda: f.read(self.SYNC_DATA_MAX), ''):
+                    sock.sendall('DATA' + struct.pack('<I', len(data)) + data)
+            sock.sendall('DONE' + struct.pack('<I', int(os.path.getmtime(local_path))))
+
+            reply, length = struct.unpack('<4sI', self._read_exactly(sock, 8))
+            if reply != 'OKAY':
+                raise AdbClientError("Pushing %s failed: %s" % (local_path, self._read_exactly(sock, length)))
+            sock.sendall('QUIT' + struct.pack('<I', 0))
+        finally:
+            sock.close()
+
+    def pull(self, serial, remote_path, local_path):
+        sock = self._transport(serial)
+        try:
+            self._send_request(sock, 'sync:')
+            sock.sendall('RECV' + struct.pack('<I', len(remote_path)) + remote_path)
+            with open(local_path, 'wb') as f:
+                while True:
+                    reply, length = struct.unpack('<4sI', self._read_exactly(sock, 8))
+                    if reply == 'DATA':
+                        f.write(self._read_exactly(sock, length))
+                    elif reply == 'DONE':
+                        break
+                    else:
+                        raise AdbClientError("Pulling %s failed: %s" % (remote_path, self._read_exactly(sock, length)))
+            sock.sendall('QUIT' + struct.pack('<I', 0))
+        finally:
+            sock.close()
+
+    def install(self, serial, apk, reinstall=True, timeout=None):
+        '''
+        Pushes the apk to the device and installs it with the package
+        manager, like `adb install` does.
+        '''
+        remote_path = '/data/local/tmp/%s' % os.path.basename(apk)
+        self.push(serial, apk, remote_path)
+        try:
+            return self.shell(serial, 'pm install %s"%s"' % ('-r ' if reinstall else '', remote_path), timeout)
+        finally:
+            self.shell(serial, 'rm "%s"' % remote_path)
+
+    # adb command line
+
+    def execute(self, serial, args, timeout=None):
+        '''
+        Runs the adb command line `args` (without "adb -s <serial>") and
+        returns (rc, output, errput) like the adb executable would. Raises
+        NotImplementedError for commands the client does not support.
+        '''
+        args = list(args)
+        try:
+            if args[:1] == ['wait-for-device']:
+                self.wait_for_device(serial, timeout)
+                args = args[1:]
+                if not args:
+                    return 0, '', ''
+
+            command, args = args[0], args[1:]
+            if command == 'shell' and args:
+                rc, output = self.shell(serial, ' '.join(args), timeout)
+            elif command == 'install':
+                rc, output = self.install(serial, args[-1], '-r' in args, timeout)
+                rc = rc or int('Success' not in output)
+            elif command == 'uninstall' and len(args) == 1:
+                rc, output = self.shell(serial, 'pm uninstall %s' % args[0], timeout)
+            elif command == 'forward' and len(args) == 2:
+                self.forward(serial, *args)
+                rc, output = 0, ''
+            elif command == 'push' and len(args) == 2:
+                self.push(serial, *args)
+                rc, output = 0, ''
+            elif command == 'pull' and len(args) == 2:
+                self.pull(serial, *args)
+                rc, output = 0, ''
+            else:
+                raise NotImplementedError("adb %s is not supported by the adb client" % ' '.join([command] + args))
+        except (AdbClientError, socket.error), e:
+            return 1, '', str(e)
+        return rc, output, ''
+
+
+class AdbClientShell(object):
+    '''
+    Runs shell commands through an AdbClient with the interface of AdbShell,
+    each command uses its own connection to the adb server.
+    '''
+
+    def __init__(self, client, serial):
+        self._client = client
+        self._serial = serial
+
+    def run(self, command, timeout=30):
+        try:
+            return self._client.shell(self._serial, command, timeout)
+        except (AdbClientError, socket.error), e:
+            raise AdbShellError(str(e))
+
+    def close(self):
+        pass
@@ -0,0 +1,117 @@
+import logging
+import subprocess
+import threading
+import time
+import uuid
+from Queue import Queue, Empty
+
+import killableprocess
+
+
+class AdbShellError(Exception):
+    '''
+    The shell session died or a command did not finish in time. The session
+    is closed afterwards.
+    '''
+
+
+class AdbShell(object):
+    '''
+    A long running `adb shell` session that commands are written to one
+    after another, instead of starting a new adb process for each of them.
+    Commands from several threads are run one at a time.
+
+    The end of every command's output is marked by a random sentinel
+    followed by the command's exit code, at the end of its last line.
+
+    `adb_command` is the adb invocation without the "shell" argument, e.g.
+    ['adb', '-s', 'emulator-5554'].
+    '''
+
+    def __init__(self, adb_command):
+        self._adb_command = list(adb_command)
+        self._proc = None
+        self._lines = None
+        self._sentinel = uuid.uuid4().hex
+        self._lock = threading.RLock()
+
+    @property
+    def alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self):
+        self.close()
+        logging.debug("$> %s shell # persistent", ' '.join(self._adb_command))
+        self._proc = killableprocess.Popen(self._adb_command + ['shell'],
+                                           stdin=subprocess.PIPE,
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.STDOUT)
+        self._lines = Queue()
+        reader = threading.Thread(target=self._read, args=(self._proc.stdout, self._lines))
+        reader.daemon = True
+        reader.start()
+
+        # older adb versions always talk to the shell through a pty, which
+        # prompts and echoes every command back
+        self._run("export PS1='' PS2=''; stty -echo 2>/dev/null; true", 30)
+
+    def _read(self, stdout, lines):
+        for line in iter(stdout.readline, ''):
+            lines.put(line)
+        lines.put(None)
+
+    def run(self, command, timeout=30):
+        '''
+        Runs `command` in the shell and returns its exit code and the output
+        of stdout and stderr.
+        '''
+        with self._lock:
+            if not self.alive:
+                self.start()
+            return self._run(command, timeout)
+
+    def _run(self, command, timeout):
+        # the quotes keep the sentinel from matching in the echo of the
+        # command that terminals with a pty send back
+        marker = '%s_%s' % (self._sentinel[:16], self._sentinel[16:])
+        line = '{ %s; } 2>&1 < /dev/null; echo "%s""_%s" $?\n' % (
+            command, self._sentinel[:16], self._sentinel[16:])
+
+        try:
+            self._proc.stdin.write(line)
+            self._proc.stdin.flush()
+        except (IOError, OSError), e:
+            self.close()
+            raise AdbShellError("Writing to adb shell failed: %s" % e)
+
+        deadline = time.time() + timeout
+        output = []
+        while True:
+            try:
+                received = self._lines.get(timeout=max(deadline - time.time(), 0))
+            except Empty:
+                self.close()
+                raise AdbShellError("'%s' did not finish within %ss" % (command, timeout))
+
+            if received is None:
+                self.close()
+                raise AdbShellError("adb shell exited while running '%s'" % command)
+
+            # output without a trailing newline ends on the marker's line
+            before, found, rc = received.replace('\r', '').rpartition(marker)
+            if found:
+                output.append(before)
+                return int(rc.strip() or -1), ''.join(output)
+            output.append(rc)
+
+    def close(self):
+        with self._lock:
+            if self._proc is None:
+                return
+            if self._proc.poll() is None:
+                try:
+                    self._proc.stdin.close()
+                except (IOError, OSError):
+                    pass
+                self._proc.wait(5)
+            self._proc = None
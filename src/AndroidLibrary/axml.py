@@ -0,0 +1,188 @@
+'''
+Reader for the binary XML format of AndroidManifest.xml in apk files
+
+Only as much of the format is decoded as is needed to find the package name
+and the main activity, see ResourceTypes.h in the Android framework sources
+for the complete format.
+'''
+
+import os
+import struct
+import threading
+import zipfile
+
+RES_STRING_POOL_TYPE = 0x0001
+RES_XML_TYPE = 0x0003
+RES_XML_START_ELEMENT_TYPE = 0x0102
+RES_XML_END_ELEMENT_TYPE = 0x0103
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+
+UTF8_FLAG = 1 << 8
+NO_INDEX = 0xffffffff
+TYPE_STRING = 0x03
+
+# resource id of android:name, used when obfuscators strip attribute names
+ATTR_NAME = 0x01010003
+
+MAIN_ACTION = 'android.intent.action.MAIN'
+
+
+class AxmlError(Exception):
+    '''
+    The data is not a binary XML document this reader understands.
+    '''
+
+
+class _StringPool(object):
+
+    def __init__(self, data, offset):
+        (header_size, size, count, style_count, flags,
+         strings_start, styles_start) = struct.unpack_from('<HIIIIII', data, offset + 2)
+        self._data = data
+        self._utf8 = bool(flags & UTF8_FLAG)
+        self._strings_start = offset + strings_start
+        self._offsets = struct.unpack_from('<%dI' % count, data, offset + header_size)
+        self._cache = {}
+
+    def __getitem__(self, index):
+        if index == NO_INDEX:
+            return None
+        if index not in self._cache:
+            self._cache[index] = self._decode(self._strings_start + self._offsets[index])
+        return self._cache[index]
+
+    def _length(self, offset, unit):
+        # lengths with the high bit set take two units
+        fmt, high = ('<B', 0x80) if unit == 1 else ('<H', 0x8000)
+        length, = struct.unpack_from(fmt, self._data, offset)
+        if length & high:
+            low, = struct.unpack_from(fmt, self._data, offset + unit)
+            return ((length & ~high) << (8 * unit)) | low, offset + 2 * unit
+        return length, offset + unit
+
+    def _decode(self, offset):
+        if self._utf8:
+            # length in utf-16 units first, then in bytes
+            length, offset = self._length(offset, 1)
+            length, offset = self._length(offset, 1)
+            return self._data[offset:offset + length].decode('utf-8', 'replace')
+        length, offset = self._length(offset, 2)
+        return self._data[offset:offset + 2 * length].decode('utf-16-le', 'replace')
+
+
+def iter_elements(data):
+    '''
+    Yields ('start', name, attributes) and ('end', name, None) for the
+    elements of the binary XML document `data` in document order.
+    `attributes` maps attribute names without namespace to string values,
+    attributes that are no strings are left out.
+    '''
+    if len(data) < 8:
+        raise AxmlError("Document is too short")
+    chunk_type, header_size, size = struct.unpack_from('<HHI', data, 0)
+    if chunk_type != RES_XML_TYPE:
+        raise AxmlError("Not a binary XML document: chunk type 0x%04x" % chunk_type)
+
+    strings = None
+    resource_ids = ()
+    offset = header_size
+    end = min(size, len(data))
+    while offset + 8 <= end:
+        chunk_type, header_size, size = struct.unpack_from('<HHI', data, offset)
+        if size < 8:
+            raise AxmlError("Invalid chunk size %d at %d" % (size, offset))
+
+        if chunk_type == RES_STRING_POOL_TYPE:
+            strings = _StringPool(data, offset)
+        elif chunk_type == RES_XML_RESOURCE_MAP_TYPE:
+            count = (size - header_size) // 4
+            resource_ids = struct.unpack_from('<%dI' % count, data, offset + header_size)
+        elif chunk_type in (RES_XML_START_ELEMENT_TYPE, RES_XML_END_ELEMENT_TYPE):
+            if strings is None:
+                raise AxmlError("Element before string pool at %d" % offset)
+            name_index, = struct.unpack_from('<I', data, offset + header_size + 4)
+            if chunk_type == RES_XML_END_ELEMENT_TYPE:
+                yield 'end', strings[name_index], None
+            else:
+                yield 'start', strings[name_index], _attributes(data, offset + header_size, strings, resource_ids)
+
+        offset += size
+
+
+def _attributes(data, offset, strings, resource_ids):
+    attribute_start, attribute_size, count = struct.unpack_from('<HHH', data, offset + 8)
+    attributes = {}
+    offset += attribute_start
+    for i in range(count):
+        name_index, raw_value, data_type, value = struct.unpack_from(
+            '<4xIIxxxBI', data, offset + i * attribute_size)
+        name = strings[name_index]
+        if not name and name_index < len(resource_ids) and resource_ids[name_index] == ATTR_NAME:
+            name = 'name'
+        if raw_value != NO_INDEX:
+            attributes[name] = strings[raw_value]
+        elif data_type == TYPE_STRING:
+            attributes[name] = strings[value]
+    return attributes
+
+
+def main_activity(data):
+    '''
+    Returns the package name and the name of the activity handling the MAIN
+    action, as written in the manifest, from the binary AndroidManifest.xml
+    `data`. The activity is None if there is none.
+    '''
+    package = None
+    # name of the enclosing activity, whether inside one of its intent filters
+    activity = None
+    in_filter = False
+    for event, name, attributes in iter_elements(data):
+        if event == 'start':
+            if name == 'manifest':
+                package = attributes.get('package')
+            elif name in ('activity', 'activity-alias'):
+                activity = attributes.get('name')
+            elif name == 'intent-filter':
+                in_filter = activity is not None
+            elif name == 'action' and in_filter and attributes.get('name') == MAIN_ACTION:
+                return package, activity
+        elif name in ('activity', 'activity-alias'):
+            activity = None
+        elif name == 'intent-filter':
+            in_filter = False
+
+    if package is None:
+        raise AxmlError("No package name found in manifest")
+    return package, None
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def apk_main_activity(apk):
+    '''
+    Returns the package name and main activity of the apk, see
+    `main_activity`. Results are kept as long as the apk's size and mtime
+    stay the same.
+    '''
+    stat = os.stat(apk)
+    key = (os.path.abspath(apk), stat.st_size, stat.st_mtime)
+    with _manifests_lock:
+        if key in _manifests:
+            return _manifests[key]
+
+    try:
+        with zipfile.ZipFile(apk) as archive:
+            data = archive.read('AndroidManifest.xml')
+    except (zipfile.BadZipfile, KeyError), e:
+        raise AxmlError("Could not read AndroidManifest.xml from %s: %s" % (apk, e))
+
+    try:
+        result = main_activity(data)
+    except struct.error, e:
+        raise AxmlError("Manifest of %s is truncated: %s" % (apk, e))
+
+    with _manifests_lock:
+        _manifests[key] = result
+    return result
@@ -0,0 +1,97 @@
+import logging
+import time
+
+from adbshell import AdbShell, AdbShellError
+
+
+def _property_is(*values):
+    return lambda output: output.strip() in values
+
+
+def _package_manager_running(output):
+    return output.strip().startswith('package:')
+
+
+class BootWaiter(object):
+    '''
+    Waits until Android on a device is usable, not only reachable by adb.
+
+    After `adb wait-for-device` returned, the phases below are polled one
+    after another through a single persistent adb shell, with exponentially
+    growing intervals. The time every phase took is kept in `timings`.
+    '''
+
+    DEVICE_PHASE = 'device'
+
+    # (name, shell command, check of its output)
+    PHASES = (
+        ('boot_completed', 'getprop sys.boot_completed', _property_is('1')),
+        # devices without boot animation never set this property
+        ('boot_animation', 'getprop init.svc.bootanim', _property_is('stopped', '')),
+        ('package_manager', 'pm path android', _package_manager_running),
+    )
+
+    def __init__(self, adb_command, execute, shell=None, initial_interval=0.1, max_interval=2.0):
+        '''
+        `adb_command` is the adb invocation for the device without
+        subcommand, `execute` runs a command and returns (rc, output, errput),
+        like AndroidLibrary._execute_with_timeout. An already open AdbShell
+        of the device can be passed as `shell`, it is left open.
+        '''
+        self._adb_command = list(adb_command)
+        self._execute = execute
+        self._shell = shell
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.timings = []
+
+    def wait(self, timeout=300, phases=None):
+        '''
+        Waits for all or the given `phases`, 'device' being the
+        `adb wait-for-device` that precedes all others. Returns a list of
+        (phase, seconds) tuples, raises AssertionError with the phase that
+        did not finish if `timeout` seconds are exceeded.
+        '''
+        deadline = time.time() + timeout
+        self.timings = []
+
+        if phases is None or self.DEVICE_PHASE in phases:
+            started = time.time()
+            rc, output, errput = self._execute(self._adb_command + ['wait-for-device'],
+                                               max_timeout=timeout, max_attempts=1)
+            assert rc == 0, "Device did not become available in %ss: %d, %r" % (timeout, rc, errput)
+            self.timings.append((self.DEVICE_PHASE, time.time() - started))
+
+        shell = self._shell or AdbShell(self._adb_command)
+        try:
+            for name, command, check in self.PHASES:
+                if phases is not None and name not in phases:
+                    continue
+                started = time.time()
+                self._poll(shell, name, command, check, deadline)
+                self.timings.append((name, time.time() - started))
+        finally:
+            if shell is not self._shell:
+                shell.close()
+
+        logging.debug("Device ready: %s", ', '.join('%s %.2fs' % timing for timing in self.timings))
+        return self.timings
+
+    def _poll(self, shell, name, command, check, deadline):
+        interval = self.initial_interval
+        output = None
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise AssertionError("Device did not finish '%s' in time, last output of '%s': %r" % (
+                    name, command, output))
+            try:
+                rc, output = shell.run(command, timeout=min(remaining, 30))
+                if rc == 0 and check(output):
+                    return
+            except AdbShellError, e:
+                # adbd restarts during boot, the next run reopens the shell
+                logging.debug("Polling '%s' failed: %s", name, e)
+
+            time.sleep(max(min(interval, deadline - time.time()), 0))
+            interval = min(interval * 2, self.max_interval)
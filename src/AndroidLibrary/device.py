@@ -0,0 +1,148 @@
+import errno
+import os
+import re
+import tempfile
+from urlparse import urlparse
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class Device(object):
+    '''
+    Everything the library keeps per device: its adb serial, the url of the
+    test server running on it and the processes and connections belonging
+    to it.
+    '''
+
+    def __init__(self, serial=None, url=None):
+        self.serial = serial
+        self.url = None
+        self.hostname = None
+        self.port = None
+        self.emulator_proc = None
+        self.testserver_proc = None
+        self.testserver_started = None
+        # whether testserver_proc runs as long as the test server does
+        self.testserver_waits = False
+        self.testserver_ready_time = None
+        self.last_screenshot = None
+        self.snapshot = None
+        self.javascript = True
+        self.recorder = None
+        self.logcat = None
+        self.session = None
+        self.shell = None
+        self.claim = None
+        self.lease = None
+        if url is not None:
+            self.set_url(url)
+
+    def set_url(self, url):
+        parsed_url = urlparse(url)
+
+        self.port = parsed_url.port
+        self.hostname = parsed_url.hostname
+        self.url = url
+
+    @property
+    def emulator_port(self):
+        '''
+        Console port of the emulator for serials like "emulator-5554", None
+        for all other devices
+        '''
+        match = re.match(r'^emulator-(\d+)$', self.serial or '')
+        if match is None:
+            return None
+        return int(match.group(1))
+
+
+class DeviceClaim(object):
+    '''
+    Exclusive claim of a device by this process, held as a lock on a file
+    named after the serial. The lock is released by the operating system
+    when the process dies, so claims of crashed test runs never go stale.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a')
+        try:
+            self._lock()
+        except:
+            self._file.close()
+            raise
+
+    def _lock(self):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+
+    def release(self):
+        if self._file.closed:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+
+
+class DevicePool(object):
+    '''
+    Hands out (serial, port) pairs to test processes running in parallel,
+    e.g. pabot workers, so that no two of them drive the same device or
+    forward the same local port.
+
+    All processes sharing a pool have to use the same `lock_dir`.
+    '''
+
+    def __init__(self, lock_dir=None):
+        if lock_dir is None:
+            lock_dir = os.path.join(tempfile.gettempdir(), 'robotframework-androidlibrary-devices')
+        self.lock_dir = lock_dir
+
+    def _lock_path(self, name):
+        return os.path.join(self.lock_dir, re.sub(r'[^\w.-]', '_', name) + '.lock')
+
+    def claim(self, candidates):
+        '''
+        Claims the first free of the given (serial, port) pairs. Returns the
+        pair together with its DeviceClaim, raises AssertionError if all of
+        them are taken.
+        '''
+        try:
+            os.makedirs(self.lock_dir)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        for serial, port in candidates:
+            try:
+                serial_claim = DeviceClaim(self._lock_path(serial))
+            except (IOError, OSError):
+                continue
+            try:
+                port_claim = DeviceClaim(self._lock_path('port-%d' % port))
+            except (IOError, OSError):
+                serial_claim.release()
+                continue
+            return serial, port, _ClaimGroup(serial_claim, port_claim)
+
+        raise AssertionError("All devices of the pool are claimed: %s" % ', '.join(
+            '%s:%d' % candidate for candidate in candidates))
+
+
+class _ClaimGroup(object):
+
+    def __init__(self, *claims):
+        self._claims = claims
+
+    def release(self):
+        for claim in self._claims:
+            claim.release()
@@ -0,0 +1,179 @@
+import logging
+import subprocess
+import time
+
+from boot import BootWaiter
+
+
+class EmulatorInstance(object):
+    '''
+    One emulator started by an EmulatorPool
+    '''
+
+    def __init__(self, port):
+        self.port = port
+        self.serial = 'emulator-%d' % port
+        self.proc = None
+        self.boot_time = None
+        self.boot_phases = []
+        self.healthy = False
+        self.leased = False
+        self.leases = 0
+        self.restarts = 0
+
+    def status(self):
+        return {
+            'serial': self.serial,
+            'boot_time': self.boot_time,
+            'boot_phases': self.boot_phases,
+            'healthy': self.healthy,
+            'leased': self.leased,
+            'leases': self.leases,
+            'restarts': self.restarts,
+        }
+
+
+class EmulatorPool(object):
+    '''
+    Boots a number of emulators of the same AVD up front and leases them to
+    test suites one at a time, resetting them in between.
+
+    Emulators are booted from `snapshot` if given, which takes seconds
+    instead of the minutes of a cold boot. `execute` runs a command and
+    returns (rc, output, errput), like AndroidLibrary._execute_with_timeout.
+    '''
+
+    RESET_MODES = ('snapshot', 'clear', 'uninstall', 'none')
+
+    def __init__(self, emulator, adb, execute, avd_name, size, base_port=5554,
+                 snapshot=None, emulator_args=(), boot_timeout=300):
+        self._emulator = emulator
+        self._adb = adb
+        self._execute = execute
+        self.avd_name = avd_name
+        self.snapshot = snapshot
+        self.emulator_args = list(emulator_args)
+        self.boot_timeout = boot_timeout
+        # emulators use two consecutive ports (console and adb)
+        self.instances = [EmulatorInstance(base_port + 2 * i) for i in range(size)]
+
+    def _adb_command(self, instance, *args):
+        return [self._adb, '-s', instance.serial] + list(args)
+
+    def _spawn(self, instance):
+        args = [self._emulator, '-avd', self.avd_name, '-port', str(instance.port),
+                '-no-snapshot-save'] + self.emulator_args
+        if self.snapshot:
+            args.extend(['-snapshot', self.snapshot])
+        logging.debug("$> %s", ' '.join(args))
+        instance.proc = subprocess.Popen(args)
+        instance.healthy = False
+        return time.time()
+
+    def _wait_for_boot(self, instance, started):
+        waiter = BootWaiter(self._adb_command(instance), self._execute)
+        try:
+            waiter.wait(max(self.boot_timeout - (time.time() - started), 0))
+            instance.healthy = True
+        except AssertionError, e:
+            logging.warn("Emulator %s did not come up: %s" % (instance.serial, e))
+        instance.boot_time = time.time() - started
+        instance.boot_phases = waiter.timings
+
+    def start(self):
+        '''
+        Boots all emulators in parallel and waits until they are available.
+        '''
+        started = [(instance, self._spawn(instance)) for instance in self.instances]
+        for instance, start_time in started:
+            self._wait_for_boot(instance, start_time)
+
+        assert any(instance.healthy for instance in self.instances), (
+            "None of the emulators of the pool could be started")
+
+    def _kill(self, instance):
+        if instance.proc is not None:
+            if instance.proc.poll() is None:
+                instance.proc.terminate()
+                instance.proc.kill()
+            instance.proc.wait()
+            instance.proc = None
+        instance.healthy = False
+
+    def restart(self, instance):
+        self._kill(instance)
+        instance.restarts += 1
+        self._wait_for_boot(instance, self._spawn(instance))
+
+    def stop(self):
+        for instance in self.instances:
+            self._kill(instance)
+
+    def is_healthy(self, instance):
+        if instance.proc is None or instance.proc.poll() is not None:
+            return False
+        rc, output, errput = self._execute(
+            self._adb_command(instance, 'shell', 'getprop', 'sys.boot_completed'),
+            max_timeout=10, max_attempts=1)
+        return rc == 0 and output.strip() == '1'
+
+    def lease(self):
+        '''
+        Returns a free, healthy emulator and marks it as leased. Emulators
+        that crashed or hang are restarted.
+        '''
+        for instance in self.instances:
+            if instance.leased:
+                continue
+            if not self.is_healthy(instance):
+                logging.warn("Emulator %s is not healthy, restarting it" % instance.serial)
+                self.restart(instance)
+                if not instance.healthy:
+                    continue
+            instance.leased = True
+            instance.leases += 1
+            return instance
+
+        raise AssertionError("No emulator of the pool is available, %d are leased" % (
+            len([instance for instance in self.instances if instance.leased])))
+
+    def reset_commands(self, reset=None, packages=()):
+        '''
+        Returns the adb commands resetting an emulator, fails if `reset` is
+        not possible.
+
+        `reset` is one of 'snapshot' (reload the snapshot the pool was booted
+        from), 'clear' (clear the data of `packages`), 'uninstall' (remove
+        `packages`) or 'none'. Defaults to 'snapshot' if the pool was booted
+        from one, to 'none' otherwise.
+        '''
+        if reset is None:
+            reset = 'snapshot' if self.snapshot else 'none'
+        assert reset in self.RESET_MODES, "Reset mode must be one of %s, but was '%s'" % (
+            ', '.join(self.RESET_MODES), reset)
+
+        if reset == 'snapshot':
+            assert self.snapshot, "The emulator pool was not started from a snapshot"
+            commands = [('emu', 'avd', 'snapshot', 'load', self.snapshot)]
+        elif reset == 'clear':
+            commands = [('shell', 'pm', 'clear', package) for package in packages]
+        elif reset == 'uninstall':
+            commands = [('uninstall', package) for package in packages]
+        else:
+            commands = []
+        return commands
+
+    def release(self, instance, reset=None, packages=()):
+        '''
+        Resets the emulator like `reset_commands` describes and returns it
+        to the pool, also if resetting failed.
+        '''
+        try:
+            for command in self.reset_commands(reset, packages):
+                rc, output, errput = self._execute(self._adb_command(instance, *command), max_attempts=1)
+                if rc != 0:
+                    logging.warn("Resetting emulator %s failed, restarting it: %r" % (instance.serial, errput))
+                    self.restart(instance)
+                    break
+        finally:
+            instance.leased = False
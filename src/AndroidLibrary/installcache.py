@@ -0,0 +1,84 @@
+import hashlib
+import os
+import threading
+
+
+class InstallCache(object):
+    '''
+    Knows which build of a package is installed on a device, to skip
+    installing the same apk again.
+
+    After every install a fingerprint file with the md5 digest of the apk and
+    the path the package manager installed it to is written to the device.
+    An apk counts as installed if the package manager still reports that
+    path and the digest matches. Reinstalling the package by other means
+    moves it to a new path, which invalidates the fingerprint.
+
+    `run` arguments are callables taking a shell command and returning
+    (rc, output) for the device in question.
+    '''
+
+    FINGERPRINT_DIR = '/data/local/tmp/robotframework-androidlibrary'
+
+    def __init__(self):
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def digest(self, apk):
+        '''
+        md5 hex digest of the apk, remembered as long as its size and mtime
+        do not change
+        '''
+        stat = os.stat(apk)
+        key = (os.path.abspath(apk), stat.st_size, stat.st_mtime)
+        with self._lock:
+            if key in self._digests:
+                return self._digests[key]
+
+        digest = hashlib.md5()
+        with open(apk, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), ''):
+                digest.update(chunk)
+
+        with self._lock:
+            self._digests[key] = digest.hexdigest()
+        return self._digests[key]
+
+    def _fingerprint_path(self, package_name):
+        return '%s/%s.fingerprint' % (self.FINGERPRINT_DIR, package_name)
+
+    def _installed_path(self, output):
+        for line in output.splitlines():
+            if line.startswith('package:'):
+                # split apks list the base apk first
+                return line[len('package:'):].strip()
+        return None
+
+    def is_installed(self, run, package_name, digest):
+        rc, output = run('pm path %s; cat %s 2>/dev/null' % (
+            package_name, self._fingerprint_path(package_name)))
+        installed_path = self._installed_path(output)
+        if installed_path is None:
+            return False
+
+        if '%s %s' % (digest, installed_path) in output.splitlines():
+            return True
+
+        # installed before the cache knew about it, compare the apk itself
+        rc, output = run('md5sum %s' % installed_path)
+        if rc == 0 and output.split()[:1] == [digest]:
+            self.record(run, package_name, digest, installed_path)
+            return True
+        return False
+
+    def record(self, run, package_name, digest, installed_path=None):
+        if installed_path is None:
+            rc, output = run('pm path %s' % package_name)
+            installed_path = self._installed_path(output)
+            if installed_path is None:
+                return
+        run('mkdir -p %s && echo "%s %s" > %s' % (
+            self.FINGERPRINT_DIR, digest, installed_path, self._fingerprint_path(package_name)))
+
+    def forget(self, run, package_name):
+        run('rm -f %s' % self._fingerprint_path(package_name))
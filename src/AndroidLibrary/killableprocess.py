@@ -38,6 +38,11 @@ processes that launch subprocesses to be reliably killed on Windows (via the Pop
 It also adds a timeout argument to Wait() for a limited period of time before
 forcefully killing the process.
 
+On POSIX every child is reaped by a thread blocking in waitpid(), which
+signals the exit through a pipe. Waiting with a timeout is a select() on that
+pipe, so no SIGCHLD handler is installed and any number of threads can wait
+for any number of children at the same time.
+
 Note: On Windows, this module requires Windows 2000 or higher (no support for
 Windows 95, 98, or NT 4.0). It also requires ctypes, which is bundled with
 Python 2.5+ or available from http://python.net/crew/theller/ctypes/
@@ -46,6 +51,8 @@ Python 2.5+ or available from http://python.net/crew/theller/ctypes/
 import subprocess
 import sys
 import os
+import tempfile
+import threading
 import time
 import types
 
@@ -68,8 +75,15 @@ mswindows = (sys.platform == "win32")
 if mswindows:
     import winprocess
 else:
+    import errno
+    import fcntl
+    import select
     import signal
 
+# Output captured by Popen.capture is kept in memory up to this many bytes
+# per stream, anything beyond is spilled to a temporary file.
+SPOOL_SIZE = 1024 * 1024
+
 def call(*args, **kwargs):
     waitargs = {}
     if "timeout" in kwargs:
@@ -88,10 +102,6 @@ def check_call(*args, **kwargs):
             cmd = args[0]
         raise CalledProcessError(retcode, cmd)
 
-if not mswindows:
-    def DoNothing(*args):
-        pass
-
 class Popen(subprocess.Popen):
     if not mswindows:
         # Override __init__ to set a preexec_fn
@@ -109,6 +119,69 @@ class Popen(subprocess.Popen):
 
             subprocess.Popen.__init__(self, *args, **kwargs)
 
+            # the reaper thread writes to this pipe once the child was reaped
+            self._exit_fd, exit_wfd = os.pipe()
+            for fd in (self._exit_fd, exit_wfd):
+                fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+            reaper = threading.Thread(target=self._reap, args=(exit_wfd,),
+                                      name='killableprocess-reaper-%d' % self.pid)
+            reaper.daemon = True
+            reaper.start()
+
+        def _reap(self, exit_wfd, _os=os, _errno=errno):
+            # module globals are gone if the interpreter exits while a child
+            # is still running, hence the references in default arguments
+            while True:
+                try:
+                    pid, sts = _os.waitpid(self.pid, 0)
+                    break
+                except OSError, e:
+                    if e.errno == _errno.EINTR:
+                        continue
+                    if e.errno != _errno.ECHILD:
+                        raise
+                    # somebody else reaped the child, its status is lost
+                    sts = 0
+                    break
+
+            # a returncode set by kill() is kept. Decoded here rather than
+            # with _handle_exitstatus(), which fails at interpreter shutdown.
+            if self.returncode is None:
+                if _os.WIFSIGNALED(sts):
+                    self.returncode = -_os.WTERMSIG(sts)
+                else:
+                    self.returncode = _os.WEXITSTATUS(sts)
+            _os.write(exit_wfd, 'x')
+            _os.close(exit_wfd)
+
+        def _wait_for_exit(self, timeout=None):
+            """Block until the child was reaped or timeout seconds have
+            passed, returns whether the child was reaped."""
+            if timeout is not None:
+                deadline = time.time() + timeout
+
+            while True:
+                try:
+                    ready, _, _ = select.select([self._exit_fd], [], [], timeout)
+                    return bool(ready)
+                except select.error, e:
+                    if e.args[0] != errno.EINTR:
+                        raise
+                if timeout is not None:
+                    timeout = max(deadline - time.time(), 0)
+
+        def _internal_poll(self, *args, **kwargs):
+            # only the reaper thread may call waitpid() for this child, it
+            # sets returncode as soon as the child is gone
+            return self.returncode
+
+        def __del__(self, _close=os.close, _Popen=subprocess.Popen, **kwargs):
+            exit_fd = self.__dict__.pop('_exit_fd', None)
+            if exit_fd is not None:
+                _close(exit_fd)
+            _Popen.__del__(self, **kwargs)
+
     if mswindows:
         def _execute_child(self, args, executable, preexec_fn, close_fds,
                            cwd, env, universal_newlines, startupinfo,
@@ -172,11 +245,20 @@ class Popen(subprocess.Popen):
                 winprocess.TerminateProcess(self._handle, 127)
             self.returncode = 127    
         else:
-            if group:
-                os.killpg(self.pid, signal.SIGKILL)
-            else:
-                os.kill(self.pid, signal.SIGKILL)
-            self.returncode = -9
+            try:
+                if group:
+                    os.killpg(self.pid, signal.SIGKILL)
+                else:
+                    os.kill(self.pid, signal.SIGKILL)
+            except OSError, e:
+                if e.errno != errno.ESRCH:
+                    raise
+                # the child exited on its own and was reaped meanwhile, the
+                # reaper sets its real exit status
+                self._wait_for_exit()
+                return
+            if self.returncode is None:
+                self.returncode = -9
 
     def wait(self, timeout=-1, group=True):
         """Wait for the process to terminate. Returns returncode attribute.
@@ -197,27 +279,106 @@ class Popen(subprocess.Popen):
                 self.returncode = winprocess.GetExitCodeProcess(self._handle)
         else:
             if timeout == -1:
-                subprocess.Popen.wait(self)
+                self._wait_for_exit()
                 return self.returncode
-            
-            starttime = time.time()
 
-            # Make sure there is a signal handler for SIGCHLD installed
-            oldsignal = signal.signal(signal.SIGCHLD, DoNothing)
+            if not self._wait_for_exit(timeout):
+                self.kill(group)
+                self._wait_for_exit()
 
-            while time.time() < starttime + timeout - 0.01:
-                pid, sts = os.waitpid(self.pid, os.WNOHANG)
-                if pid != 0:
-                    self._handle_exitstatus(sts)
-                    signal.signal(signal.SIGCHLD, oldsignal)
-                    return self.returncode
-                
-                # time.sleep is interrupted by signals (good!)
-                newtimeout = timeout - time.time() + starttime
-                time.sleep(newtimeout)
+        return self.returncode
 
-            self.kill(group)
-            signal.signal(signal.SIGCHLD, oldsignal)
-            subprocess.Popen.wait(self)
+    def capture(self, timeout=-1, group=True, spool_size=SPOOL_SIZE):
+        """Read stdout and stderr of a process created with stdout=PIPE and
+        stderr=PIPE until it terminates. Returns a (stdout, stderr) tuple of
+        file objects positioned at the start of the captured output, which
+        stays in memory up to spool_size bytes and is spilled to disk beyond.
+        If timeout seconds are reached the process is killed like in wait().
+        """
 
-        return self.returncode
+        streams = (self.stdout, self.stderr)
+        spools = [tempfile.SpooledTemporaryFile(max_size=spool_size) for stream in streams]
+
+        if timeout == -1:
+            deadline = None
+        else:
+            deadline = time.time() + timeout
+
+        if mswindows:
+            self._capture_threaded(streams, spools, deadline, group)
+        else:
+            self._capture_select(streams, spools, deadline, group)
+
+        for stream in streams:
+            stream.close()
+
+        if deadline is None:
+            self.wait()
+        else:
+            self.wait(max(deadline - time.time(), 0), group)
+
+        for spool in spools:
+            spool.seek(0)
+        return tuple(spools)
+
+    def _capture_select(self, streams, spools, deadline, group):
+        spool_for_fd = dict((stream.fileno(), spool) for stream, spool in zip(streams, spools))
+        open_fds = spool_for_fd.keys()
+        exited = False
+
+        while open_fds:
+            if exited:
+                # only drain what is left, grandchildren might keep the
+                # pipes open long after the child is gone
+                remaining = 0
+                fds = open_fds
+            else:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self.kill(group)
+                        return
+                fds = open_fds + [self._exit_fd]
+
+            try:
+                ready, _, _ = select.select(fds, [], [], remaining)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            if exited and not ready:
+                return
+
+            for fd in ready:
+                if fd == self._exit_fd:
+                    exited = True
+                    continue
+                data = os.read(fd, 65536)
+                if data:
+                    spool_for_fd[fd].write(data)
+                else:
+                    open_fds.remove(fd)
+
+    def _capture_threaded(self, streams, spools, deadline, group):
+        # select() does not work on pipes on Windows, read them in threads
+        def copy(stream, spool):
+            for data in iter(lambda: stream.read(65536), ''):
+                spool.write(data)
+
+        readers = [threading.Thread(target=copy, args=pair) for pair in zip(streams, spools)]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+
+        for reader in readers:
+            if deadline is None:
+                reader.join()
+            else:
+                reader.join(max(deadline - time.time(), 0))
+
+        if any(reader.is_alive() for reader in readers):
+            self.kill(group)
+            for reader in readers:
+                reader.join()
@@ -0,0 +1,87 @@
+import collections
+import gzip
+import logging
+import subprocess
+import threading
+import time
+
+import killableprocess
+
+
+class LogcatCollector(object):
+    '''
+    Streams `adb logcat` of a device in the background.
+
+    The last `max_lines` lines are kept in memory together with the time
+    they were received, older ones are dropped, so memory use does not grow
+    with the length of the test run. If `path` is given, all lines are
+    additionally written to that file, gzip compressed if it ends with .gz.
+
+    `adb_command` is the adb invocation for the device without subcommand.
+    `tags` limits the log to these tags, `priority` is the lowest priority
+    to include (V, D, I, W, E, F), both are filtered on the device.
+    '''
+
+    PRIORITIES = 'VDIWEF'
+
+    def __init__(self, adb_command, tags=(), priority='V', max_lines=10000, path=None):
+        priority = priority.upper()[:1]
+        assert priority and priority in self.PRIORITIES, \
+            "Priority must be one of %s, but was '%s'" % (', '.join(self.PRIORITIES), priority)
+        if tags:
+            filters = ['%s:%s' % (tag, priority) for tag in tags] + ['*:S']
+        else:
+            filters = ['*:%s' % priority]
+        self._args = list(adb_command) + ['logcat', '-v', 'threadtime'] + filters
+        self.max_lines = int(max_lines)
+        self._lines = collections.deque(maxlen=self.max_lines)
+        self._dropped_until = None
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            self._file = gzip.open(path, 'wb') if path.endswith('.gz') else open(path, 'wb')
+        self.path = path
+        self._proc = None
+        self._thread = None
+
+    def start(self):
+        logging.debug("$> %s", ' '.join(self._args))
+        self._proc = killableprocess.Popen(self._args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self._thread = threading.Thread(target=self._read)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _read(self):
+        for line in iter(self._proc.stdout.readline, ''):
+            with self._lock:
+                if len(self._lines) == self.max_lines:
+                    self._dropped_until = self._lines[0][0]
+                self._lines.append((time.time(), line))
+                if self._file is not None:
+                    self._file.write(line)
+
+    def lines(self, since=None):
+        '''
+        Returns the buffered lines received at or after the time `since`,
+        all buffered lines if it is None.
+        '''
+        with self._lock:
+            lines = list(self._lines)
+        return [line for received, line in lines if since is None or received >= since]
+
+    def truncated(self, since=None):
+        '''
+        Whether lines received at or after `since` were dropped from memory
+        '''
+        with self._lock:
+            return self._dropped_until is not None and (since is None or self._dropped_until >= since)
+
+    def stop(self):
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.wait()
+        self._thread.join()
+        if self._file is not None:
+            with self._lock:
+                self._file.close()
+                self._file = None
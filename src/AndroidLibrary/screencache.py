@@ -0,0 +1,55 @@
+import collections
+import json
+import threading
+import time
+
+
+class ScreenCache(object):
+    '''
+    Responses of read-only actions of the test server, kept until the
+    screen changes or for at most `ttl` seconds.
+
+    Entries are keyed by the device url, the command and its arguments.
+    Only successful responses are cached, failed assertions are always
+    asked again so retrying them can succeed. At most `max_entries` are
+    kept, the oldest are dropped first.
+    '''
+
+    def __init__(self, ttl=5, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, url, command, arguments):
+        return url, command, json.dumps(arguments)
+
+    def get(self, url, command, arguments):
+        '''
+        Returns the cached response, None if there is none
+        '''
+        key = self._key(url, command, arguments)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or time.time() - entry[0] <= self.ttl):
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, url, command, arguments, response):
+        with self._lock:
+            self._entries[self._key(url, command, arguments)] = (time.time(), response)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def statistics(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
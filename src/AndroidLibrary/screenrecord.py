@@ -0,0 +1,86 @@
+import logging
+import threading
+import time
+import uuid
+
+import killableprocess
+
+
+class ScreenRecorder(object):
+    '''
+    Records the screen of a device with `adb shell screenrecord` in the
+    background.
+
+    screenrecord stops after at most three minutes, so longer recordings
+    consist of several segments, a new one is started whenever the previous
+    ended. `segments` lists the (remote path, start time) of each.
+
+    `adb_command` is the adb invocation for the device without subcommand,
+    `shell` runs a shell command on the device and returns (rc, output).
+    '''
+
+    REMOTE_DIR = '/sdcard'
+    TIME_LIMIT = 180
+
+    def __init__(self, adb_command, shell, bit_rate=None, size=None):
+        self._adb_command = list(adb_command)
+        self._shell = shell
+        self._options = []
+        if bit_rate:
+            self._options.extend(['--bit-rate', str(int(bit_rate))])
+        if size:
+            self._options.extend(['--size', size])
+        self._name = uuid.uuid4().hex[:8]
+        self._proc = None
+        self._thread = None
+        self._stopping = False
+        self._lock = threading.Lock()
+        self.segments = []
+        self.error = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._record)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _record(self):
+        while True:
+            with self._lock:
+                if self._stopping:
+                    return
+                remote_path = '%s/androidlibrary-%s-%d.mp4' % (self.REMOTE_DIR, self._name, len(self.segments))
+                args = self._adb_command + ['shell', 'screenrecord', '--time-limit', str(self.TIME_LIMIT)]
+                args += self._options + [remote_path]
+                logging.debug("$> %s", ' '.join(args))
+                started = time.time()
+                self._proc = killableprocess.Popen(args)
+                self.segments.append((remote_path, started))
+
+            self._proc.wait()
+            if self._proc.returncode != 0 and not self._stopping:
+                # screenrecord is missing or the options are not supported
+                self.error = "screenrecord exited with %d" % self._proc.returncode
+                logging.warn("Screen recording failed: %s" % self.error)
+                return
+
+    def stop(self, timeout=15):
+        '''
+        Stops recording and waits until the last segment is written
+        completely. Returns the time the recording stopped.
+        '''
+        with self._lock:
+            self._stopping = True
+        stopped = time.time()
+
+        # screenrecord only finishes the mp4 file on SIGINT, killing adb
+        # would leave it unplayable
+        deadline = stopped + timeout
+        while self._thread.is_alive() and time.time() < deadline:
+            self._shell('pkill -INT screenrecord || kill -INT $(pidof screenrecord)')
+            self._thread.join(min(2, max(deadline - time.time(), 0)))
+
+        if self._thread.is_alive():
+            logging.warn("screenrecord did not stop within %ss, killing it" % timeout)
+            self._proc.kill()
+            self._thread.join()
+        return stopped
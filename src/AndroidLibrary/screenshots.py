@@ -0,0 +1,159 @@
+import atexit
+import hashlib
+import logging
+import threading
+from cStringIO import StringIO
+from Queue import Queue
+
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        Image = None
+
+# format name as PIL knows it and file extension
+FORMATS = {
+    'png': ('PNG', 'png'),
+    'jpeg': ('JPEG', 'jpg'),
+    'webp': ('WEBP', 'webp'),
+}
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ScreenshotOptions(object):
+    '''
+    How screenshots are stored: `format` one of FORMATS, `quality` for jpeg
+    and webp (1-100), `max_width` in pixels to scale larger screenshots down
+    to. Screenshots are written as received from the device if none of them
+    applies.
+
+    `deduplicate` stores screenshots in files named after their content,
+    `skip_unchanged` how many bits the perceptual hashes of two deduplicated
+    screenshots may differ in for the second one to be skipped.
+    '''
+
+    def __init__(self, format='png', quality=None, max_width=None, deduplicate=False, skip_unchanged=None):
+        assert format in FORMATS, "Screenshot format must be one of %s, but was '%s'" % (
+            ', '.join(sorted(FORMATS)), format)
+        self.format = format
+        self.quality = int(quality) if quality else None
+        self.max_width = int(max_width) if max_width else None
+        self.deduplicate = deduplicate
+        self.skip_unchanged = int(skip_unchanged) if skip_unchanged not in (None, '') else None
+        assert deduplicate or self.skip_unchanged is None, "Skipping unchanged screenshots needs deduplicate"
+        assert Image is not None or not (self.reencode or self.skip_unchanged is not None), (
+            "Converting, scaling or comparing screenshots needs the Python Imaging Library (PIL or Pillow)")
+
+    @property
+    def extension(self):
+        return FORMATS[self.format][1]
+
+    @property
+    def reencode(self):
+        return self.format != 'png' or self.max_width is not None
+
+    def filename(self, content):
+        '''
+        Name of the file storing the screenshot `content` with these options
+        if screenshots are deduplicated
+        '''
+        name = 'android-screenshot-%s' % hashlib.sha1(content).hexdigest()
+        if self.quality is not None:
+            name += '-q%d' % self.quality
+        if self.max_width is not None:
+            name += '-w%d' % self.max_width
+        return '%s.%s' % (name, self.extension)
+
+    def save(self, content, path):
+        '''
+        Writes the screenshot `content` as received from the device to `path`.
+        '''
+        if not self.reencode:
+            with open(path, 'wb') as f:
+                f.write(content)
+            return
+
+        image = Image.open(StringIO(content))
+        if self.max_width is not None and image.size[0] > self.max_width:
+            height = image.size[1] * self.max_width // image.size[0]
+            image = image.resize((self.max_width, height), Image.ANTIALIAS)
+        if self.format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        kwargs = {'optimize': True}
+        if self.quality is not None:
+            kwargs['quality'] = self.quality
+        image.save(path, FORMATS[self.format][0], **kwargs)
+
+
+def screen_signature(content):
+    '''
+    Perceptual signature of the screenshot `content`: a 64 bit difference
+    hash, whether each pixel of a 9x8 grayscale thumbnail is brighter than its
+    right neighbour, and the mean brightness, which tells apart screens
+    without any edges. Screens that look the same have hashes differing in
+    few bits.
+    '''
+    image = Image.open(StringIO(content)).convert('L').resize((9, 8), Image.ANTIALIAS)
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            value = value << 1 | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return value, sum(pixels) / len(pixels)
+
+
+def same_screen(a, b, max_bits, max_brightness=8):
+    '''
+    Whether the signatures `a` and `b` differ in at most `max_bits` bits of
+    their hash and `max_brightness` in their brightness
+    '''
+    return bin(a[0] ^ b[0]).count('1') <= max_bits and abs(a[1] - b[1]) <= max_brightness
+
+
+class ScreenshotWriter(object):
+    '''
+    Saves screenshots in a background thread, so tests do not wait for the
+    disk or for re-encoding. Errors are reported by the next `put` or
+    `flush`. Screenshots still queued when the process exits are written
+    before it does.
+    '''
+
+    def __init__(self):
+        self._queue = Queue()
+        self._errors = []
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self._queue.join)
+
+    def _run(self):
+        while True:
+            options, content, path = self._queue.get()
+            try:
+                options.save(content, path)
+            except Exception, e:
+                logging.warn("Saving screenshot %s failed: %s" % (path, e))
+                self._errors.append((path, e))
+            finally:
+                self._queue.task_done()
+
+    def _raise_errors(self):
+        if self._errors:
+            errors, self._errors = self._errors, []
+            raise AssertionError("Saving %d screenshots failed: %s" % (
+                len(errors), '; '.join('%s: %s' % error for error in errors)))
+
+    def put(self, options, content, path):
+        self._raise_errors()
+        self._queue.put((options, content, path))
+
+    def flush(self):
+        '''
+        Waits until all queued screenshots are written.
+        '''
+        self._queue.join()
+        self._raise_errors()
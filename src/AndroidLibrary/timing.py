@@ -0,0 +1,185 @@
+'''
+Timings of keywords, adb commands and HTTP requests of a test run
+'''
+
+import csv
+import json
+import os
+import threading
+import time
+from cgi import escape
+
+from robot.libraries.BuiltIn import BuiltIn
+
+
+class Timings(object):
+    '''
+    Records how long calls took. `kind` groups calls ('keyword', 'adb',
+    'shell', 'http' or 'action'), `name` identifies what was called,
+    `status` is the exit code, HTTP status or keyword status, `attempts` how
+    often it was tried and `bytes` how much output it returned, if known.
+    '''
+
+    FIELDS = ('kind', 'name', 'started', 'seconds', 'status', 'attempts', 'bytes')
+    SUMMARY_FIELDS = ('kind', 'name', 'calls', 'failures', 'total', 'mean', 'p95', 'max', 'attempts', 'bytes')
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def record(self, kind, name, started, status=None, attempts=1, bytes=None):
+        '''
+        Records a call that started at `started` and ends now.
+        '''
+        seconds = time.time() - started
+        with self._lock:
+            self.records.append((kind, name, started, seconds, status, attempts, bytes))
+
+    def clear(self):
+        with self._lock:
+            self.records = []
+
+    def _failed(self, kind, status):
+        if kind == 'keyword':
+            return status == 'FAIL'
+        if kind in ('http', 'action'):
+            return status is None or status >= 400
+        return status != 0
+
+    def summary(self):
+        '''
+        Returns a dict per kind and name of call with the fields in
+        SUMMARY_FIELDS, the most time consuming first.
+        '''
+        with self._lock:
+            records = list(self.records)
+
+        groups = {}
+        for kind, name, started, seconds, status, attempts, size in records:
+            groups.setdefault((kind, name), []).append((seconds, status, attempts, size))
+
+        summary = []
+        for (kind, name), calls in groups.items():
+            seconds = sorted(call[0] for call in calls)
+            summary.append({
+                'kind': kind,
+                'name': name,
+                'calls': len(calls),
+                'failures': len([call for call in calls if self._failed(kind, call[1])]),
+                'total': sum(seconds),
+                'mean': sum(seconds) / len(seconds),
+                'p95': seconds[min(int(len(seconds) * 0.95), len(seconds) - 1)],
+                'max': seconds[-1],
+                'attempts': sum(call[2] for call in calls),
+                'bytes': sum(call[3] or 0 for call in calls),
+            })
+        summary.sort(key=lambda row: row['total'], reverse=True)
+        return summary
+
+    def write_json(self, path):
+        with self._lock:
+            calls = [dict(zip(self.FIELDS, record)) for record in self.records]
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(), 'calls': calls}, f, indent=1)
+
+    def write_csv(self, path):
+        with open(path, 'wb') as f:
+            writer = csv.DictWriter(f, self.SUMMARY_FIELDS)
+            writer.writerow(dict(zip(self.SUMMARY_FIELDS, self.SUMMARY_FIELDS)))
+            writer.writerows(self.summary())
+
+    def write_prometheus(self, path):
+        '''
+        Writes the summary in the text format of Prometheus, for the
+        textfile collector of the node exporter for example.
+        '''
+        lines = [
+            '# HELP androidlibrary_call_seconds Time spent in calls of AndroidLibrary.',
+            '# TYPE androidlibrary_call_seconds summary',
+        ]
+        rows = self.summary()
+        for row in rows:
+            labels = 'kind="%s",name="%s"' % (row['kind'], row['name'].replace('\\', '\\\\').replace('"', '\\"'))
+            lines.append('androidlibrary_call_seconds{%s,quantile="0.95"} %f' % (labels, row['p95']))
+            lines.append('androidlibrary_call_seconds_sum{%s} %f' % (labels, row['total']))
+            lines.append('androidlibrary_call_seconds_count{%s} %d' % (labels, row['calls']))
+        for metric, field, help in (('failures', 'failures', 'Failed calls of AndroidLibrary.'),
+                                    ('bytes', 'bytes', 'Bytes returned by calls of AndroidLibrary.')):
+            lines.append('# HELP androidlibrary_call_%s_total %s' % (metric, help))
+            lines.append('# TYPE androidlibrary_call_%s_total counter' % metric)
+            for row in rows:
+                labels = 'kind="%s",name="%s"' % (row['kind'], row['name'].replace('\\', '\\\\').replace('"', '\\"'))
+                lines.append('androidlibrary_call_%s_total{%s} %d' % (metric, labels, row[field]))
+
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def html_table(self):
+        rows = ['<tr>%s</tr>' % ''.join('<th>%s</th>' % field for field in self.SUMMARY_FIELDS)]
+        for row in self.summary():
+            rows.append('<tr>%s</tr>' % ''.join(
+                '<td>%s</td>' % (('%.3f' % row[field]) if isinstance(row[field], float) else escape(str(row[field])))
+                for field in self.SUMMARY_FIELDS))
+        return '<table border="1">%s</table>' % ''.join(rows)
+
+    def robot_table(self):
+        '''
+        Returns the summary as a table in Robot Framework's documentation
+        syntax, e.g. for suite metadata.
+        '''
+        rows = ['| %s |' % ' | '.join('=%s=' % field for field in self.SUMMARY_FIELDS)]
+        for row in self.summary():
+            rows.append('| %s |' % ' | '.join(
+                ('%.3f' % row[field]) if isinstance(row[field], float) else
+                unicode(row[field]).replace('\\', '\\\\').replace('|', '\\|')
+                for field in self.SUMMARY_FIELDS))
+        return '\n'.join(rows)
+
+
+class TimingListener(object):
+    '''
+    Robot Framework listener recording the duration of the keywords in
+    `keywords` (normalized names) and writing the timings to `report`.json
+    and `report`.csv when the test run ends, `report` being a function that
+    returns that path or None. If there is a report, the summary is also
+    added as a table to the metadata of the top level suite.
+
+    `test_started` is the time the current test started, None outside of
+    tests.
+    '''
+
+    ROBOT_LISTENER_API_VERSION = 2
+
+    def __init__(self, timings, keywords, report):
+        self._timings = timings
+        self._keywords = keywords
+        self._report = report
+        self.test_started = None
+
+    def start_test(self, name, attrs):
+        self.test_started = time.time()
+
+    def end_test(self, name, attrs):
+        self.test_started = None
+
+    def end_suite(self, name, attrs):
+        # the listener is only called for suites importing the library, the
+        # top level suite keeps the table of the last of them
+        if self._report() and self._timings.records:
+            BuiltIn().set_suite_metadata('AndroidLibrary Timings', self._timings.robot_table(), top=True)
+
+    def end_keyword(self, name, attrs):
+        keyword = name.rsplit('.', 1)[-1]
+        if keyword.lower().replace(' ', '').replace('_', '') not in self._keywords:
+            return
+        seconds = attrs['elapsedtime'] / 1000.0
+        self._timings.record('keyword', keyword, time.time() - seconds, attrs['status'])
+
+    def close(self):
+        report = self._report()
+        if report:
+            directory = os.path.dirname(report)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._timings.write_json(report + '.json')
+            self._timings.write_csv(report + '.csv')
@@ -0,0 +1,88 @@
+'''
+Local copy of the view hierarchy of the screen
+'''
+
+import logging
+
+# actions of the test server that only read the screen
+READ_ONLY_COMMANDS = frozenset(['assert_text', 'query'])
+
+# actions of the test server that change the screen, or wait for it to change
+MUTATING_COMMANDS = frozenset([
+    'press_button_with_text', 'click_on_text', 'click_on_screen', 'click_on_view_by_description',
+    'press_image_button_number', 'press_image_button_description',
+    'enter_text_into_numbered_field', 'enter_text_into_named_field', 'set_text',
+    'scroll_up', 'scroll_down', 'scroll_to', 'swipe', 'touch', 'go_back',
+    'wait_for_text', 'execute_javascript',
+])
+
+
+def mutates(command):
+    '''
+    Whether the action `command` may change what is on the screen. Commands
+    in neither set are assumed to.
+    '''
+    if command in READ_ONLY_COMMANDS:
+        return False
+    if command not in MUTATING_COMMANDS:
+        logging.debug("Unknown action '%s', assuming it changes the screen", command)
+    return True
+
+
+class ViewSnapshot(object):
+    '''
+    The views of a view hierarchy dump of the test server, indexed by text,
+    id, class and content description.
+
+    Each view is kept as a (class, id, text, description) tuple in `views`.
+    The test server reports them as `type` or `class`, `id`, `value` or
+    `text` and `label` or `contentDescription`. Invisible views are left
+    out.
+    '''
+
+    # in the order of the fields of a view
+    STRATEGIES = ('class', 'id', 'text', 'desc')
+
+    def __init__(self, root):
+        self.views = []
+        self._index = dict((strategy, {}) for strategy in self.STRATEGIES)
+
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(reversed(node))
+                continue
+            if not isinstance(node, dict) or node.get('visible') is False:
+                continue
+            view = (node.get('class') or node.get('type'), node.get('id'),
+                    node.get('text', node.get('value')), node.get('contentDescription', node.get('label')))
+            for strategy, value in zip(self.STRATEGIES, view):
+                if isinstance(value, basestring) and value:
+                    self._index[strategy].setdefault(value, []).append(len(self.views))
+            self.views.append(view)
+            stack.extend(reversed(node.get('children') or []))
+
+    def find(self, strategy, value):
+        '''
+        Returns the views whose `strategy` ('class', 'id', 'text' or 'desc')
+        equals `value`. Ids match with or without their package, classes
+        with or without theirs.
+        '''
+        assert strategy in self.STRATEGIES, 'Locator strategy must be one of "%s", but was %s' % (
+            '", "'.join(self.STRATEGIES), strategy)
+        index = self._index[strategy]
+        positions = list(index.get(value, []))
+        if strategy in ('id', 'class') and not positions:
+            separator = '/' if strategy == 'id' else '.'
+            for key, found in index.iteritems():
+                if key.rsplit(separator, 1)[-1] == value:
+                    positions.extend(found)
+        return [self.views[position] for position in sorted(positions)]
+
+    def contains_text(self, text):
+        '''
+        Whether a view's text contains `text`
+        '''
+        texts = self._index['text']
+        return text in texts or any(text in key for key in texts)
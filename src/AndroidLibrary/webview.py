@@ -0,0 +1,74 @@
+'''
+JavaScript for the `execute_javascript` action of the test server, which
+evaluates queries in the webview and returns only their result
+
+Every script returns a JSON object, {"result": ...} or {"error": "..."} if
+evaluating the query threw, e.g. for an invalid selector. Use `result` to
+get the value back.
+'''
+
+import json
+
+
+def _script(expression):
+    return ('try { return JSON.stringify({result: %s}); } '
+            'catch (e) { return JSON.stringify({error: String(e)}); }' % expression)
+
+
+def result(message):
+    '''
+    Returns the result of a script of this module from the message of the
+    test server's response, raises AssertionError if the script failed.
+    '''
+    try:
+        decoded = json.loads(message)
+    except (TypeError, ValueError):
+        decoded = None
+    if not isinstance(decoded, dict) or not ('result' in decoded or 'error' in decoded):
+        raise AssertionError("Executing JavaScript in the webview failed: %s" % message)
+    if 'error' in decoded:
+        raise AssertionError("Executing JavaScript in the webview failed: %s" % decoded['error'])
+    return decoded['result']
+
+
+def _elements(strategy, query):
+    # an expression for the array of elements matching the locator
+    if strategy == 'css':
+        return 'Array.prototype.slice.call(document.querySelectorAll(%s))' % json.dumps(query)
+    if strategy == 'xpath':
+        return ('(function() { var r = document.evaluate(%s, document, null, '
+                'XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null), a = []; '
+                'for (var i = 0; i < r.snapshotLength; i++) { a.push(r.snapshotItem(i)); } '
+                'return a; })()' % json.dumps(query))
+    raise AssertionError('Locator strategy must be one of "css", "xpath", but was %s' % strategy)
+
+
+def contains_script(text):
+    '''
+    Returns whether the text of the document contains `text`
+    '''
+    return _script('document.documentElement.textContent.indexOf(%s) >= 0' % json.dumps(text))
+
+
+def count_script(strategy, query, text=None):
+    '''
+    Returns the number of elements matching the locator whose text contains
+    `text`, if given
+    '''
+    elements = _elements(strategy, query)
+    if text is not None:
+        elements = '%s.filter(function(e) { return e.textContent.indexOf(%s) >= 0; })' % (
+            elements, json.dumps(text))
+    return _script('%s.length' % elements)
+
+
+def projection_script(strategy, query, fields):
+    '''
+    Returns a list with an object of the `fields` (attributes or properties,
+    like textContent or href) of each element matching the locator
+    '''
+    return _script('%s.map(function(e) { var f = %s, o = {}; '
+                   'for (var i = 0; i < f.length; i++) { '
+                   'var v = e.hasAttribute(f[i]) ? e.getAttribute(f[i]) : e[f[i]]; '
+                   'o[f[i]] = v === null || typeof v != "object" ? v : String(v); } '
+                   'return o; })' % (_elements(strategy, query), json.dumps(list(fields))))